@@ -0,0 +1,3 @@
+"""
+Preprocessing and analysis of the CCS conjoint survey.
+"""
@@ -0,0 +1,72 @@
+"""
+Command line entry point for the preprocessing and analysis stages.
+
+    python -m scripts ingest                  # run one stage
+    python -m scripts fit-basic
+    python -m scripts summarize output/inference_basic_choice.nc --var-names beta delta
+    python -m scripts run fit-basic           # bring stages up to date, see pipeline.py
+
+Stages run in this process and import their libraries only when they run,
+so the command itself starts without pandas, pymc, pytensor or arviz.
+"""
+import argparse
+import runpy
+import sys
+
+# module run by each stage subcommand, the stages of pipeline.py
+STAGE_MODULES = {
+    "ingest": "scripts.preprocessing.prepocessing_basics",
+    "values": "scripts.preprocessing.value_indices",
+    "translate": "scripts.preprocessing.translate_conjoints",
+    "fit-basic": "scripts.analysis.basic_choice_model",
+    "fit-hybrid": "scripts.analysis.hybrid_choice_model",
+    "marginal-means": "scripts.hainmueller.mms",
+}
+
+def run_stage(args):
+    runpy.run_module(STAGE_MODULES[args.command], run_name="__main__", alter_sys=True)
+
+def summarize(args):
+    import arviz as az
+    import pandas as pd
+
+    idata = az.from_netcdf(args.path)
+    summary = az.summary(idata, var_names=args.var_names, kind=args.kind)
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(summary)
+
+def run_pipeline(args):
+    from scripts.pipeline import run
+
+    run(args.targets, force=args.force, dry_run=args.dry_run)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name, module in STAGE_MODULES.items():
+        stage = commands.add_parser(name, help=f"run {module}")
+        stage.set_defaults(func=run_stage)
+
+    summary = commands.add_parser("summarize", help="summary statistics of a saved posterior")
+    summary.add_argument("path", nargs="?", default="output/inference_basic_choice.nc", help="NetCDF file")
+    summary.add_argument("--var-names", nargs="+", default=["beta", "delta", "gamma"], help="variables to summarize")
+    summary.add_argument("--kind", choices=["all", "stats", "diagnostics"], default="all")
+    summary.set_defaults(func=summarize)
+
+    pipeline = commands.add_parser("run", help="run the stages that are out of date, as pipeline.py")
+    pipeline.add_argument("targets", nargs="*", help=f"stages to bring up to date, one of {list(STAGE_MODULES)}")
+    pipeline.add_argument("--force", action="store_true", help="rerun the stages even if they are up to date")
+    pipeline.add_argument("--dry-run", action="store_true", help="only print which stages would run")
+    pipeline.set_defaults(func=run_pipeline)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
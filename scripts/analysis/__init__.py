@@ -0,0 +1,3 @@
+"""
+Choice models, their inputs, sampling and posterior simulation.
+"""
@@ -0,0 +1,165 @@
+import numpy as np
+import xarray as xr
+
+from scripts.analysis.model_inputs import pad_by_respondent
+
+# minibatch ADVI
+#
+# Approximate versions of the choice models for quick refits. Each step
+# evaluates the likelihood on a random minibatch and scales it up to the
+# full data. The basic model batches tasks. The hybrid model batches
+# respondents with all their tasks and Likert answers, so that each
+# respondent's latent traits see all of the respondent's data in a step.
+#
+# The priors are the ones of the NUTS models in basic_choice_model.py and
+# hybrid_choice_model.py. The per-task Deterministics are left out, since
+# they only exist for the batch.
+#
+# pymc, pytensor and the likelihood Op are imported in the functions that
+# build or fit the models.
+
+def _design_names(encoding):
+    if encoding == "index":
+        return ["level_index_left", "level_index_right"]
+    return ["attribute_levels_diff"]
+
+def basic_minibatch_model(inputs, encoding="index", batch_size=512):
+    """
+    Basic choice model on minibatches of batch_size tasks.
+    """
+    import pymc as pm
+
+    from scripts.analysis.likelihood import paired_logit_loglike
+
+    n_tasks = len(inputs["f"])
+    batch_size = min(batch_size, n_tasks)
+    weight = inputs["weight"] if "weight" in inputs else np.ones(n_tasks)
+
+    names = ["f", "c", "observed_choice_left", "weight"] + _design_names(encoding)
+    arrays = [np.asarray(weight if name == "weight" else inputs[name]) for name in names]
+    batch = dict(zip(names, pm.Minibatch(*arrays, batch_size=batch_size)))
+
+    with pm.Model(coords=inputs["coords"]) as model:
+        # main effect of attribute levels
+        beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
+
+        # framing-specific shift for each attribute level
+        delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
+
+        # country effect
+        gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
+
+        # batch log-likelihood scaled up to all tasks
+        loglike = paired_logit_loglike(
+            beta, delta, gamma,
+            *[batch[name] for name in _design_names(encoding)],
+            batch["f"], batch["c"], batch["observed_choice_left"],
+            encoding=encoding, weights=batch["weight"],
+        )
+        pm.Potential("choice_distribution", n_tasks / batch_size * loglike)
+
+    return model
+
+def hybrid_minibatch_model(inputs, encoding="index", batch_size=64, likert_sigma=0.1):
+    """
+    Hybrid choice model on minibatches of batch_size respondents, with all
+    their tasks and Likert answers.
+    """
+    import pymc as pm
+    import pytensor.tensor as pt
+
+    from scripts.analysis.likelihood import paired_logit_loglike
+
+    padded = pad_by_respondent(inputs)
+    n_individuals = len(padded["individual"])
+    n_slots = padded["f"].shape[1]
+    batch_size = min(batch_size, n_individuals)
+    scale = n_individuals / batch_size
+
+    names = [
+        "individual", "f", "c", "observed_choice_left", "weight",
+        "indicator_value", "indicator_mask",
+    ] + _design_names(encoding)
+    batch = dict(zip(names, pm.Minibatch(*[padded[name] for name in names], batch_size=batch_size)))
+
+    with pm.Model(coords=inputs["coords"]) as model:
+        # latent traits per individual, non-centered
+        latent_raw = pm.Normal("latent_raw", mu=0, sigma=1, dims=["individual", "trait"])
+        latent_mu = pm.Normal("latent_mu", mu=0.5, sigma=0.5, dims="trait")
+        latent_sigma = pm.HalfNormal("latent_sigma", sigma=0.5, dims="trait")
+        latent = pm.Deterministic(
+            "latent", latent_mu + latent_sigma * latent_raw, dims=["individual", "trait"]
+        )
+
+        # Likert answers of the batch's respondents, missing answers masked
+        individual = batch["individual"]
+        indicator_mu = latent[individual][:, padded["item_trait"]]
+        indicator_loglike = pm.logp(
+            pm.Normal.dist(mu=indicator_mu, sigma=likert_sigma), batch["indicator_value"]
+        )
+        pm.Potential("likert_indicators", scale * (indicator_loglike * batch["indicator_mask"]).sum())
+
+        # coefficients
+        theta = pm.Normal("theta", mu=0, sigma=1, dims=["trait", "level"])
+        beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
+        delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
+        gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
+
+        # flatten (respondent x task slot) to tasks, padding has weight 0
+        design = [
+            batch[name].reshape((-1, padded[name].shape[2])) for name in _design_names(encoding)
+        ]
+        z = latent_raw[pt.repeat(individual, n_slots)]
+
+        loglike = paired_logit_loglike(
+            beta, delta, gamma, *design,
+            batch["f"].reshape((-1,)).astype("float32"),
+            batch["c"].reshape((-1,)),
+            batch["observed_choice_left"].reshape((-1,)),
+            encoding=encoding, theta=theta, z=z, weights=batch["weight"].reshape((-1,)),
+        )
+        pm.Potential("choice_distribution", scale * loglike)
+
+    return model
+
+class LossConvergence:
+    """
+    Early stopping for pm.fit: every `every` iterations, compare the mean
+    loss of the last window with the window before, and stop once the
+    relative improvement is below tolerance. Averaging over windows smooths
+    out the minibatch noise in the loss.
+    """
+
+    def __init__(self, every=500, tolerance=1e-3):
+        self.every = every
+        self.tolerance = tolerance
+
+    def __call__(self, approx, loss_hist, i):
+        if i % self.every or i < 2 * self.every:
+            return
+        current = np.mean(loss_hist[-self.every:])
+        previous = np.mean(loss_hist[-2 * self.every:-self.every])
+        if (previous - current) / abs(previous) < self.tolerance:
+            raise StopIteration(f"loss converged after {i} iterations")
+
+def fit_advi(model, n=50_000, draws=1000, every=500, tolerance=1e-3, random_seed=42):
+    """
+    Fit the model with ADVI for at most n iterations, stopping early when
+    the loss converges, and return draws from the approximation as
+    InferenceData like the NUTS output. The loss history is kept in the
+    group "advi_loss".
+    """
+    import pymc as pm
+
+    with model:
+        approx = pm.fit(
+            n=n,
+            method="advi",
+            callbacks=[LossConvergence(every=every, tolerance=tolerance)],
+            random_seed=random_seed,
+        )
+        inference_data = approx.sample(draws, random_seed=random_seed)
+
+    loss = xr.Dataset({"loss": ("iteration", np.asarray(approx.hist))})
+    inference_data.add_groups({"advi_loss": loss})
+    return inference_data
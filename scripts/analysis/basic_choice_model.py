@@ -3,15 +3,47 @@ import pandas as pd
 import arviz as az
 import numpy as np
 import xarray as xr
+from scripts.analysis.model_inputs import load_model_inputs
+from scripts.analysis.models import basic_choice_model
+from scripts.analysis.sampling import sample
+from scripts.analysis.simulate import simulate_profiles
+from scripts.analysis.advi import basic_minibatch_model, fit_advi
+from scripts.preprocessing.schema import BASELINES
 
-# %% pymc bug workaround
+# %% model settings
 
-import pytensor
-pytensor.config.cxx = '/usr/bin/clang++'
+# "paired_logit" uses the custom log-likelihood Op with analytic gradient,
+# "bernoulli" the original exp(u_l) / (exp(u_l) + exp(u_r)) formulation
+LIKELIHOOD = "paired_logit"
+
+# "index" stores each package as one level index per attribute, "dummies" as
+# one-hot dummies per level; the bernoulli likelihood needs "dummies"
+ENCODING = "index"
+
+# collapse identical tasks into weighted likelihood terms, the bernoulli
+# likelihood needs False
+DEDUPLICATE = True
+
+# "nuts" samples the model below, "advi" fits the minibatch ADVI version
+# of it (paired logit likelihood) for quick approximate refits
+INFERENCE = "nuts"
 
-# %% 
+# tasks (basic) or respondents (hybrid) per ADVI minibatch
+ADVI_BATCH_SIZE = 512
 
-df = pd.read_csv("data/hcm_input.csv")
+# keep utility_left, utility_right and probability_choice_left of every task
+# in the posterior; they can be computed afterwards with posterior.py
+STORE_DETERMINISTICS = False
+
+# NUTS backend: "pymc" (C backend), or "numpyro" / "blackjax" (JAX on the CPU)
+SAMPLER_BACKEND = "pymc"
+
+# %% pymc bug workaround
+
+import pytensor
+if SAMPLER_BACKEND == "pymc":
+    # only the C backend needs the compiler
+    pytensor.config.cxx = '/usr/bin/clang++'
 
 # %% define lists and translations
 
@@ -24,120 +56,28 @@ attributes = [
     "attr_source_purpose"
 ]
 
-baseline_dict = {
-    "attr_engagement": "inform",
-    "attr_vicinity": "abroad",
-    "attr_industry": "waste incineration",
-    "attr_costs": "taxpayer",
-    "attr_reason": "sparsely-populated",
-    "attr_source_purpose": "domestic"
-}
-
-# %% define dummies
-
-# reorder each attribute column by making it categorical with the baseline first
-for attr in attributes:
-    baseline = baseline_dict[attr]
-    df[attr] = pd.Categorical(df[attr], categories=[baseline] + 
-                              [level for level in df[attr].unique() if level != baseline], 
-                              ordered=True)
-
-# generate dummies with columns in the correct order
-dummies = pd.get_dummies(df[attributes], drop_first=False)
-
-# reorder columns to place baseline first for each attribute
-ordered_columns = []
-for attr in attributes:
-    # Collect the columns related to the attribute and put baseline first
-    attr_columns = [col for col in dummies.columns if col.startswith(attr)]
-    baseline_column = f"{attr}_{baseline_dict[attr]}"
-    ordered_columns.append(baseline_column)
-    ordered_columns.extend([col for col in attr_columns if col != baseline_column])
-
-# reorder dummies according to ordered columns list
-dummies = dummies[ordered_columns]
-dummies = dummies.loc[:, ~dummies.columns.duplicated()]
-
-df["framing"] = df["framing"].astype("category")
-df["country"] = df["country"].astype("category")
-
-coords = {
-    "level": dummies.columns.values,
-    "task": np.arange(len(df) // 2),
-    "framing": df["framing"].cat.categories,
-    "country": df["country"].cat.categories
-}
-
-
-# %% define model
-
-with pm.Model(coords=coords) as bayes_model:
-    
-    # main effect of attribute levels
-    beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
-
-    # framing-specific shift for each attribute level
-    delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
-    
-    # country effect
-    gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
-    
-    # framing (0 or 1), same for all tasks per participant
-    f = pm.Data("f", df.loc[df.package == 1, "framing"].cat.codes.values, dims="task")
-    country_idx = df.loc[df.package == 1, "country"].cat.codes.values
-    c = pm.Data("c", country_idx, dims = "task")
-
-    # observed choices
-    observed_choice_left = pm.Data(
-        "observed_choice_left", 
-        df.loc[df.package == 1, "chosen"].values, 
-        dims="task"
-    )
-
-    # attribute dummies
-    attribute_levels_left = pm.Data(
-        "attribute_levels_left", 
-        dummies[df.package == 1].values, 
-        dims=["task", "level"]
-    )
-
-    attribute_levels_right = pm.Data(
-        "attribute_levels_right", 
-        dummies[df.package == 2].values, 
-        dims=["task", "level"]
-    )
+# baselines of the choice table schema, see preprocessing/schema.py
+baseline_dict = {attr: BASELINES[attr] for attr in attributes}
 
-    # compute modified coefficients depending on framing
-    # this gives beta + delta * framing per task and level
-    # adding country effect
-    beta_framed = beta + delta * f[:, None] + gamma[c, :]
+# %% build model inputs
 
-    # compute utility
-    utility_left = pm.Deterministic(
-        "utility_left",
-        pm.math.sum(attribute_levels_left * beta_framed, axis=1),
-        dims="task"
-    )
+# design arrays, index vectors and coords, cached on the input file and settings
+inputs = load_model_inputs(
+    attributes, baseline_dict, drop_first=False, encoding=ENCODING, deduplicate=DEDUPLICATE
+)
+coords = inputs["coords"]
 
-    utility_right = pm.Deterministic(
-        "utility_right",
-        pm.math.sum(attribute_levels_right * beta_framed, axis=1),
-        dims="task"
-    )
 
-    # choice probability via logit
-    probability_choice_left = pm.Deterministic(
-        "probability_choice_left",
-        pm.math.exp(utility_left) / (pm.math.exp(utility_left) + pm.math.exp(utility_right)),
-        dims="task"
-    )
+# %% define model
 
-    # likelihood
-    choice_distribution = pm.Bernoulli(
-        "choice_distribution", 
-        p=probability_choice_left, 
-        observed=observed_choice_left
-    )
+# beta, delta and gamma per level, see models.py
+bayes_model = basic_choice_model(
+    inputs, 
+    likelihood = LIKELIHOOD, 
+    encoding = ENCODING, 
+    deduplicate = DEDUPLICATE, 
+    store_deterministics = STORE_DETERMINISTICS
+)
 
 # %% get priors
 
@@ -154,25 +94,44 @@ az.summary(priors, var_names = ["delta"])
 # az.plot_forest(priors, var_names=["delta"], combined=True)
 # delta_draws = priors.prior["delta"]
 
-# %% test model 
-
-with bayes_model:
-    approx = pm.fit(n=10000, method="advi")
-    trace = approx.sample(1000)
-
-# %%
+# %% run model
+
+if INFERENCE == "advi":
+    # minibatch ADVI, stops early once the loss converges
+    advi_model = basic_minibatch_model(inputs, encoding = ENCODING, batch_size = ADVI_BATCH_SIZE)
+    inference_data = fit_advi(advi_model, n = 50_000, draws = 1000, random_seed = 42)
+
+else:
+    # run model with MCMC with 1000 draws, 500 tune samples, and 4 chains on 6 cores
+    inference_data = sample(
+        bayes_model, 
+        backend = SAMPLER_BACKEND,
+        draws = 1000, 
+        tune = 500, 
+        chains = 4,
+        cores = 6, 
+        random_seed = 42, 
+        target_accept = 0.9
+    )
 
-# run model with MCMC with 1000 draws, 500 tune samples, and 4 chains on 6 cores
-inference_data = pm.sample(
-    model = bayes_model, 
-    draws = 1000, 
-    tune = 500, 
-    chains = 4,
-    cores = 6, 
-    random_seed = 42, 
-    return_inferencedata = True, 
-    target_accept = 0.9
-)
+# %% compare sampler backends
+
+# wall-clock and bulk ESS per second of each backend on the same seed and data
+# from scripts.analysis.sampling import compare_backends
+# backend_comparison, backend_traces = compare_backends(
+#     bayes_model, 
+#     var_names = ["beta", "delta", "gamma"],
+#     draws = 1000, 
+#     tune = 500, 
+#     chains = 4,
+#     random_seed = 42, 
+#     target_accept = 0.9
+# )
+# backend_comparison
+
+# synthetic table of 200 respondents, 2 chains of 500 tune and 500 draws on one
+# CPU (tests/benchmark_backends.py, blackjax 1.2.5): wall clock 225 s (pymc),
+# 86 s (numpyro), 72 s (blackjax); bulk ESS per second 3.1, 6.9 and 7.7
 
 # %% diagnostics
 
@@ -182,8 +141,25 @@ az.plot_forest(inference_data, var_names=["beta"], combined=True)
 az.plot_forest(inference_data, var_names=["delta"], combined=True)
 az.plot_forest(inference_data, var_names=["gamma"], combined=True)
 
+# %% task utilities
+
+# utility_left, utility_right and probability_choice_left per task and draw,
+# computed from the parameters in chunks of tasks when needed
+# from scripts.analysis.posterior import task_utilities
+# task_draws = task_utilities(inference_data, inputs, encoding = ENCODING)
+
 # %% save to file 
 
-inference_data.to_netcdf("output/inference_basic_choice.nc")
+if INFERENCE == "advi":
+    inference_data.to_netcdf("output/inference_basic_choice_advi.nc")
+else:
+    inference_data.to_netcdf("output/inference_basic_choice.nc")
+
+# %% simulate support for all profiles
+
+# probability of choosing each profile of the full factorial design over the
+# all-baseline profile, by country and framing, with 95% credible intervals
+profile_support = simulate_profiles(inference_data, attributes, baseline_dict, labels = coords["framing"])
+profile_support.to_csv("output/profile_support_basic.csv", index = False)
 
 # %%
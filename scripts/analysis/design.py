@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+def level_categories(df, attributes, baseline_dict):
+    """
+    Levels of each attribute with the baseline first, in the order used for
+    the dummies in the model scripts. Categorical columns with the baseline
+    as first category, as typed by preprocessing/schema.py, keep their
+    category order without the levels that do not occur; other columns list
+    the levels in order of appearance.
+    """
+    categories = {}
+    for attr in attributes:
+        values = df[attr]
+        if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories[:1].tolist() == [baseline_dict[attr]]:
+            codes = values.cat.codes.to_numpy()
+            present = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories)) > 0
+            present[0] = True
+            categories[attr] = values.cat.categories[present].tolist()
+        else:
+            categories[attr] = [baseline_dict[attr]] + [level for level in values.unique() if level != baseline_dict[attr]]
+    return categories
+
+def level_index_design(df, attributes, baseline_dict, drop_first=False):
+    """
+    Index encoding of the attribute levels: one column per attribute holding
+    the position of the row's level in the coefficient vector, instead of one
+    dummy column per level. Returns the level names, which match the dummy
+    column names, and the (row x attribute) index matrix.
+
+    With drop_first, baseline levels have no coefficient. They get the index
+    len(levels), which points to a zero appended to the coefficients.
+    """
+    categories = level_categories(df, attributes, baseline_dict)
+
+    level_names = []
+    columns = []
+    for attr in attributes:
+        levels = categories[attr][1:] if drop_first else categories[attr]
+        values = df[attr]
+        if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.tolist() == categories[attr]:
+            # already coded in this order, see level_categories
+            codes = values.cat.codes.to_numpy()
+        else:
+            codes = pd.Categorical(values, categories=categories[attr]).codes
+        if drop_first:
+            codes = codes - 1
+        columns.append((codes, len(level_names)))
+        level_names.extend(f"{attr}_{level}" for level in levels)
+
+    n_levels = len(level_names)
+    index = np.empty((len(df), len(attributes)), dtype=np.int64)
+    for j, (codes, offset) in enumerate(columns):
+        index[:, j] = np.where(codes >= 0, codes + offset, n_levels)
+
+    return level_names, index
+
+# Products of the design with coefficients
+#
+# A package is encoded as its level "dummies" (task x level) or as one level
+# "index" per attribute (task x attribute), see level_index_design. These
+# helpers multiply either encoding with coefficient vectors without building
+# the dummies. They take an array module xp, so the same code runs with
+# jax.numpy when the model is sampled through JAX (likelihood.register_jax).
+
+ENCODINGS = ["dummies", "index"]
+
+def package_products(coefs, attribute_levels, encoding, xp=np):
+    """
+    Product of one package per task (its dummies or level indices) with
+    each row of coefs (k x level), as (task x k).
+    """
+    if encoding == "dummies":
+        return attribute_levels @ coefs.T
+
+    coefs = xp.concatenate([coefs, xp.zeros((coefs.shape[0], 1), dtype=coefs.dtype)], axis=1)
+    return coefs[:, attribute_levels].sum(axis=-1).T
+
+def design_products(coefs, design, encoding, xp=np):
+    """
+    Product of the design with each row of coefs (k x level), as (task x k).
+    """
+    if encoding == "dummies":
+        (x_diff,) = design
+        return x_diff @ coefs.T
+
+    index_left, index_right = design
+    return package_products(coefs, index_left, encoding, xp) - package_products(coefs, index_right, encoding, xp)
+
+def design_transpose_products(weights, design, encoding, n_levels):
+    """
+    Transposed design times each column of weights (task x k), as (k x level).
+    """
+    if encoding == "dummies":
+        (x_diff,) = design
+        return (x_diff.T @ weights).T
+
+    index_left, index_right = design
+    n_attributes = index_left.shape[1]
+    products = np.empty((weights.shape[1], n_levels))
+    for j in range(weights.shape[1]):
+        task_weights = np.repeat(weights[:, j], n_attributes)
+        left = np.bincount(index_left.ravel(), weights=task_weights, minlength=n_levels + 1)
+        right = np.bincount(index_right.ravel(), weights=task_weights, minlength=n_levels + 1)
+        products[j] = (left - right)[:n_levels]
+    return products
+
+def utility_difference(beta, delta, gamma, design, f, c, encoding="dummies", xp=np,
+                       theta=None, z=None, return_products=False):
+    """
+    Utility difference per task, computed with numpy (or xp). With
+    return_products, also returns the products of the design with beta,
+    delta, gamma and theta, which the gradient reuses.
+    """
+    coefs = [beta, delta, gamma] if theta is None else [beta, delta, gamma, theta]
+    products = design_products(xp.vstack(coefs), design, encoding, xp=xp)
+    n_tasks = products.shape[0]
+    eta = products[:, 0] + f * products[:, 1] + products[xp.arange(n_tasks), 2 + c]
+    if theta is not None:
+        eta = eta + (products[:, 2 + gamma.shape[0]:] * z).sum(axis=1)
+    if return_products:
+        return eta, products
+    return eta
@@ -2,20 +2,59 @@ import pymc as pm
 import pandas as pd
 import arviz as az
 import numpy as np
+from scripts.analysis.model_inputs import load_model_inputs
+from scripts.analysis.models import hybrid_choice_model
+from scripts.analysis.sampling import sample, sample_checkpointed
+from scripts.analysis.advi import hybrid_minibatch_model, fit_advi
+from scripts.preprocessing.schema import BASELINES
 
-# %% pymc bug workaround
+# %% model settings
 
-import pytensor
+# "paired_logit" uses the custom log-likelihood Op with analytic gradient,
+# "bernoulli" the original exp(u_l) / (exp(u_l) + exp(u_r)) formulation
+LIKELIHOOD = "paired_logit"
 
-pytensor.config.cxx = "/usr/bin/clang++"
+# "index" stores each package as one level index per attribute, "dummies" as
+# one-hot dummies per level; the bernoulli likelihood needs "dummies"
+ENCODING = "index"
 
-# %%
+# collapse identical tasks into weighted likelihood terms, the bernoulli
+# likelihood needs False
+DEDUPLICATE = True
 
-df = (
-    pd.read_csv("~/Downloads/data_translated_ch.csv")
-    .assign(country="CH")
-    .head(12 * 100)
-)
+# "nuts" samples the model below, "advi" fits the minibatch ADVI version
+# of it (paired logit likelihood) for quick approximate refits
+INFERENCE = "nuts"
+
+# tasks (basic) or respondents (hybrid) per ADVI minibatch
+ADVI_BATCH_SIZE = 64
+
+# keep utility_left, utility_right and probability_choice_left of every task
+# in the posterior; they can be computed afterwards with posterior.py
+STORE_DETERMINISTICS = False
+
+# NUTS backend: "pymc" (C backend), or "numpyro" / "blackjax" (JAX on the CPU)
+SAMPLER_BACKEND = "pymc"
+
+# pymc NUTS draws are written to this directory in blocks, so an interrupted
+# run resumes where it stopped when rerun; None samples in one go
+CHECKPOINT_DIR = "output/checkpoints/hybrid_choice"
+
+# previous posterior to warm-start tuning from, e.g.
+# "output/inference_basic_choice.nc", with fewer tune steps
+WARM_START = None
+
+# number of respondents to fit, None for the full sample; a cap such as 100
+# only for quick debug runs
+MAX_RESPONDENTS = None
+
+# %% pymc bug workaround
+
+import pytensor
+
+if SAMPLER_BACKEND == "pymc":
+    # only the C backend needs the compiler
+    pytensor.config.cxx = "/usr/bin/clang++"
 
 # %% define attributes and baselines
 
@@ -28,60 +67,32 @@ attributes = [
     "attr_source_purpose",
 ]
 
-baseline_dict = {
-    # "attr_engagement": "inform",
-    "attr_vicinity": "abroad",
-    "attr_industry": "waste incineration",
-    "attr_costs": "taxpayer",
-    # "attr_reason": "sparsely-populated",
-    "attr_source_purpose": "domestic",
-}
-
-# %% define dummies
+# baselines of the choice table schema, see preprocessing/schema.py
+baseline_dict = {attr: BASELINES[attr] for attr in attributes}
 
-# reorder each attribute column by making it categorical with the baseline first
-for attr in attributes:
-    baseline = baseline_dict[attr]
-    df[attr] = pd.Categorical(
-        df[attr],
-        categories=[baseline]
-        + [level for level in df[attr].unique() if level != baseline],
-        ordered=True,
-    )
+# %% define latent traits and their Likert indicators
 
-# generate dummies with columns in the correct order
-# the next line is the important change
-dummies = pd.get_dummies(df[attributes], drop_first=True)
-
-# reorder columns to place baseline first for each attribute
-ordered_columns = []
-for attr in attributes:
-    # Collect the columns related to the attribute and put baseline first
-    attr_columns = [col for col in dummies.columns if col.startswith(attr)]
-    baseline_column = f"{attr}_{baseline_dict[attr]}"
-    # ordered_columns.append(baseline_column)
-    ordered_columns.extend([col for col in attr_columns if col != baseline_column])
-
-# reorder dummies according to ordered columns list
-dummies = dummies[ordered_columns]
-dummies = dummies.loc[:, ~dummies.columns.duplicated()]
-
-df["framing"] = df["framing"].astype("category")
-df["country"] = df["country"].astype("category")
-
-# add dimensions
-unique_individuals = df["id"].unique()
-coords = {
-    "level": dummies.columns.tolist(),
-    "task": np.arange(len(df) // 2),
-    "framing": df["framing"].cat.categories,
-    "country": df["country"].cat.categories,
-    "individual": unique_individuals,
+traits = {
+    "lreco": ["lreco_1", "lreco_2", "lreco_3"],
+    "galtan": ["galtan_1", "galtan_2", "galtan_3"],
+    "socio_ecol": ["socio_ecological_1", "socio_ecological_2", "socio_ecological_3"],
 }
 
-id_to_index = {id_: i for i, id_ in enumerate(unique_individuals)}
-df["individual_idx"] = df["id"].map(id_to_index)
-individual_idx = df.loc[df.package == 1, "individual_idx"].values
+# %% build model inputs
+
+# design arrays, index vectors and coords, cached on the input file and settings
+inputs = load_model_inputs(
+    attributes,
+    baseline_dict,
+    drop_first=True,
+    encoding=ENCODING,
+    traits=traits,
+    deduplicate=DEDUPLICATE,
+    max_respondents=MAX_RESPONDENTS,
+)
+coords = inputs["coords"]
+individual_idx = inputs["individual_idx"]
+unique_individuals = coords["individual"]
 
 # %% check coords
 
@@ -95,113 +106,16 @@ print("Number of unique individuals:", len(unique_individuals))
 
 # %% define HCM
 
-with pm.Model(coords=coords) as hcm_model:
-    # latent trait priors per individual
-    # lreco_latent = pm.Normal("lreco_latent", mu=0, sigma=1, dims="individual")
-    # galtan_latent = pm.Normal("galtan_latent", mu=0, sigma=1, dims="individual")
-    # socio_ecol_latent = pm.Normal("socio_ecol_latent", mu=0, sigma=1, dims="individual")
-
-    # noise in observed scores
-    # likert_sigma = 0.1
-
-    # Observed variables as continuous (normalized to 0–1)
-    # pm.Normal("lreco_1", mu=lreco_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "lreco_1"].values)
-
-    # pm.Normal("lreco_2", mu=lreco_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "lreco_2"].values)
-
-    # pm.Normal("lreco_3", mu=lreco_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "lreco_3"].values)
-
-    # pm.Normal("galtan_1", mu=galtan_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "galtan_1"].values)
-
-    # pm.Normal("galtan_2", mu=galtan_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "galtan_2"].values)
-
-    # pm.Normal("galtan_3", mu=galtan_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "galtan_3"].values)
-
-    # pm.Normal("socio_ecological_1", mu=socio_ecol_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "socio_ecological_1"].values)
-
-    # pm.Normal("socio_ecological_2", mu=socio_ecol_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "socio_ecological_2"].values)
-
-    # pm.Normal("socio_ecological_3", mu=socio_ecol_latent[individual_idx], sigma=likert_sigma,
-    #           observed=df.loc[df.package == 1, "socio_ecological_3"].values)
-
-    # get framing and country codes
-    f = pm.Data("f", df.loc[df.package == 1, "framing"].cat.codes.values, dims="task")
-    f = f.astype("float32")
-    country_idx = df.loc[df.package == 1, "country"].cat.codes.values
-    c = pm.Data("c", country_idx, dims="task")
-
-    # observed choices
-    observed_choice_left = pm.Data(
-        "observed_choice_left", df.loc[df.package == 1, "chosen"].values, dims="task"
-    )
-
-    # attribute dummies
-    attribute_levels_left = pm.Data(
-        "attribute_levels_left",
-        dummies[df.package == 1].values * 1,
-        dims=["task", "level"],
-    )
-
-    attribute_levels_right = pm.Data(
-        "attribute_levels_right",
-        dummies[df.package == 2].values * 1,
-        dims=["task", "level"],
-    )
-
-    # gamma coefficients: how much each latent trait moderates framing effects
-    theta_lreco = pm.Normal("theta_lreco", mu=0, sigma=1, dims="level")
-    theta_galtan = pm.Normal("theta_galtan", mu=0, sigma=1, dims="level")
-    theta_ecol = pm.Normal("theta_ecol", mu=0, sigma=1, dims="level")
-
-    # choice model: main effects
-    beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
-
-    # framing-specific shift
-    delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
-
-    # country effect
-    gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
-
-    beta_modulated = (
-        beta + delta * f[:, None] + gamma[c, :]
-        # + theta_lreco * lreco_latent[individual_idx][:, None]
-        # + theta_galtan * galtan_latent[individual_idx][:, None]
-        # + theta_ecol * socio_ecol_latent[individual_idx][:, None]
-    )
-
-    # get utilities
-    utility_left = pm.Deterministic(
-        "utility_left",
-        pm.math.sum(attribute_levels_left * beta_modulated, axis=1),
-        dims="task",
-    )
-
-    utility_right = pm.Deterministic(
-        "utility_right",
-        pm.math.sum(attribute_levels_right * beta_modulated, axis=1),
-        dims="task",
-    )
-
-    # logit probability
-    prob_choice_left = pm.Deterministic(
-        "probability_choice_left",
-        pm.math.exp(utility_left)
-        / (pm.math.exp(utility_left) + pm.math.exp(utility_right)),
-        dims="task",
-    )
-
-    # likelihood
-    pm.Bernoulli(
-        "choice_distribution", p=prob_choice_left, observed=observed_choice_left
-    )
+# latent traits measured by the Likert indicators moderate the level
+# effects, see models.py
+hcm_model = hybrid_choice_model(
+    inputs,
+    likelihood=LIKELIHOOD,
+    encoding=ENCODING,
+    deduplicate=DEDUPLICATE,
+    store_deterministics=STORE_DETERMINISTICS,
+    likert_sigma=0.1,
+)
 
 # %% get priors
 
@@ -221,59 +135,102 @@ az.summary(
         "beta",
         "gamma",
         "delta",
-        "theta_lreco",
+        "theta",
     ],
 )
 
-# %% test model
+# %% run model (3 to 5 hours with NUTS)
 
-# with hcm_model:
-#    approx = pm.fit(n=10000, method="advi")
-#    trace = approx.sample(1000)
+if INFERENCE == "advi":
+    # minibatch ADVI over respondents, stops early once the loss converges
+    advi_model = hybrid_minibatch_model(
+        inputs, encoding=ENCODING, batch_size=ADVI_BATCH_SIZE
+    )
+    inference_data = fit_advi(advi_model, n=50_000, draws=1000, random_seed=42)
+
+elif SAMPLER_BACKEND == "pymc" and CHECKPOINT_DIR is not None:
+    # same run in blocks of 100 draws, checkpointed to CHECKPOINT_DIR
+    inference_data = sample_checkpointed(
+        hcm_model,
+        CHECKPOINT_DIR,
+        draws=1000,
+        tune=500 if WARM_START is None else 200,
+        chains=4,
+        cores=4,
+        block_size=100,
+        random_seed=42,
+        target_accept=0.9,
+        warm_start=WARM_START,
+        inputs_key=inputs["bundle"],
+    )
 
-# %% run model (3 to 5 hours)
+else:
+    # run model with MCMC with 1000 draws, 500 tune samples, and 4 chains on 6 cores
+    inference_data = sample(
+        hcm_model,
+        backend=SAMPLER_BACKEND,
+        draws=1000,
+        tune=500,
+        chains=4,
+        cores=4,  # more cores than chains has no effect
+        random_seed=42,
+        target_accept=0.9,
+    )
 
-# run model with MCMC with 1000 draws, 500 tune samples, and 4 chains on 6 cores
-inference_data = pm.sample(
-    model=hcm_model,
-    draws=1000,
-    tune=500,
-    chains=4,
-    cores=4,  # more cores than chains has no effect
-    random_seed=42,
-    return_inferencedata=True,
-    target_accept=0.9,
-)
+# %% compare sampler backends
+
+# wall-clock and bulk ESS per second of each backend on the same seed and data
+# from scripts.analysis.sampling import compare_backends
+# backend_comparison, backend_traces = compare_backends(
+#     hcm_model,
+#     var_names=["beta", "delta", "gamma"],
+#     draws=1000,
+#     tune=500,
+#     chains=4,
+#     random_seed=42,
+#     target_accept=0.9,
+# )
+# backend_comparison
+
+# synthetic table of 100 respondents, 2 chains of 500 tune and 500 draws on one
+# CPU (tests/benchmark_backends.py, blackjax 1.2.5): wall clock 152 s (pymc),
+# 57 s (numpyro), 76 s (blackjax); bulk ESS per second 2.0, 12.9 and 7.4
 
 # %% diagnostics
 
 az.summary(
     inference_data,
-    var_names=["beta", "delta", "gamma", "theta_lreco", "theta_galtan", "theta_ecol"],
+    var_names=["beta", "delta", "gamma", "theta", "latent_mu", "latent_sigma"],
 )
 
 az.plot_trace(
     inference_data,
-    var_names=["beta", "delta", "gamma", "theta_lreco", "theta_galtan", "theta_ecol"],
+    var_names=["beta", "delta", "gamma", "theta", "latent_mu", "latent_sigma"],
 )
 
 # az.plot_dist(inference_data, var_names=[
 #     "beta",
 #     "delta",
-#     "theta_lreco",
-#     "theta_galtan",
-#     "theta_ecol"
+#     "theta",
 #     ])
 
 az.plot_forest(inference_data, var_names=["beta"], combined=True)
 az.plot_forest(inference_data, var_names=["delta"], combined=True)
 az.plot_forest(inference_data, var_names=["gamma"], combined=True)
-az.plot_forest(inference_data, var_names=["theta_lreco"], combined=True)
-az.plot_forest(inference_data, var_names=["theta_galtan"], combined=True)
-az.plot_forest(inference_data, var_names=["theta_ecol"], combined=True)
+az.plot_forest(inference_data, var_names=["theta"], combined=True)
+
+# %% task utilities
+
+# utility_left, utility_right and probability_choice_left per task and draw,
+# computed from the parameters in chunks of tasks when needed
+# from scripts.analysis.posterior import task_utilities
+# task_draws = task_utilities(inference_data, inputs, encoding=ENCODING)
 
 # %% save to netcdf
 
-inference_data.to_netcdf("output/inference_hybrid_choice.nc")
+if INFERENCE == "advi":
+    inference_data.to_netcdf("output/inference_hybrid_choice_advi.nc")
+else:
+    inference_data.to_netcdf("output/inference_hybrid_choice.nc")
 
 # %%
@@ -0,0 +1,287 @@
+import numpy as np
+import pytensor.tensor as pt
+from pytensor.gradient import grad_not_implemented
+from pytensor.graph.basic import Apply
+from pytensor.graph.op import Op
+from scipy.special import expit, log_expit
+
+from scripts.analysis.design import ENCODINGS, design_transpose_products, utility_difference
+
+# paired-choice logit
+#
+# Each task shows a left and a right package, and the respondent chooses one.
+# With x_diff the difference of the left and right attribute dummies, the
+# utility difference of a task is
+#
+#     eta = x_diff @ (beta + delta * f + gamma[c])
+#
+# and the log-likelihood of choosing left (y = 1) or right (y = 0) is
+# log_sigmoid(eta) or log_sigmoid(-eta). The coefficients per task are never
+# built: the design is multiplied with beta, delta and every country's gamma
+# separately.
+#
+# Optionally, moderators z (task x k), e.g. respondents' latent traits, shift
+# the coefficients by z @ theta, with theta (k x level):
+#
+#     eta = x_diff @ (beta + delta * f + gamma[c] + z[t] @ theta)
+#
+# With weights w (task), each task's log-likelihood counts w times, so
+# identical tasks can be collapsed into one weighted task.
+#
+# The Op gives the log-likelihood per task. Models use it as the logp of the
+# observed choices (paired_logit_dist), so they keep an observed variable
+# for predictive sampling and the pointwise log-likelihood.
+#
+# The design is either "dummies", the dense x_diff (task x level), or
+# "index", the level indices of the left and right package (task x attribute)
+# as built by design.level_index_design. Index L points to a zero coefficient.
+#
+# The numpy helpers in design.py take an array module xp, so the same code
+# runs with jax.numpy when the model is sampled through JAX (see register_jax).
+
+def task_utility(attribute_levels, beta, delta, gamma, f, c, encoding="dummies",
+                 theta=None, z=None):
+    """
+    Symbolic utility of one package per task, without the per-task
+    coefficient matrix beta + delta * f + gamma[c] (+ z @ theta).
+    attribute_levels are the package's dummies or level indices, depending
+    on the encoding.
+    """
+    n_tasks = attribute_levels.shape[0]
+    if encoding == "dummies":
+        country_terms = pt.dot(attribute_levels, gamma.T)
+        utility = (
+            pt.dot(attribute_levels, beta)
+            + f * pt.dot(attribute_levels, delta)
+            + country_terms[pt.arange(n_tasks), c]
+        )
+        if theta is not None:
+            utility = utility + (pt.dot(attribute_levels, theta.T) * z).sum(axis=1)
+        return utility
+
+    # gather the coefficients of each package's levels, index L is zero
+    beta_ext = pt.concatenate([beta, pt.zeros(1)])
+    delta_ext = pt.concatenate([delta, pt.zeros(1)])
+    gamma_ext = pt.concatenate([gamma, pt.zeros((gamma.shape[0], 1))], axis=1)
+    utility = (
+        beta_ext[attribute_levels].sum(axis=1)
+        + f * delta_ext[attribute_levels].sum(axis=1)
+        + gamma_ext[c[:, None], attribute_levels].sum(axis=1)
+    )
+    if theta is not None:
+        theta_ext = pt.concatenate([theta, pt.zeros((theta.shape[0], 1))], axis=1)
+        utility = utility + (theta_ext[:, attribute_levels].sum(axis=-1).T * z).sum(axis=1)
+    return utility
+
+def _split_inputs(inputs, encoding, moderated=False, weighted=False):
+    n_design = 1 if encoding == "dummies" else 2
+    beta, delta, gamma = inputs[:3]
+    theta = z = w = None
+    if moderated:
+        theta, z = inputs[3:5]
+        inputs = inputs[2:]
+    if weighted:
+        w = inputs[-1]
+        inputs = inputs[:-1]
+    design = inputs[3:3 + n_design]
+    f, c, y = inputs[3 + n_design:]
+    return beta, delta, gamma, theta, z, design, f, c, y, w
+
+class PairedLogitLogLikeGrad(Op):
+    """
+    Gradient of the paired logit log-likelihood with respect to beta, delta
+    and gamma, and theta and z if moderated, given the gradient g (task) of
+    the per-task log-likelihoods as last input. With r = g * (y - sigmoid(eta))
+    the gradients are design.T @ r, design.T @ (f * r), for each country the
+    same sum over its tasks, design.T @ (z[:, k] * r) for each theta[k] and
+    r * (design @ theta[k]) for z[:, k]. If weighted, r is multiplied by
+    the weights.
+    """
+    __props__ = ("encoding", "moderated", "weighted")
+
+    def __init__(self, encoding="dummies", moderated=False, weighted=False):
+        self.encoding = encoding
+        self.moderated = moderated
+        self.weighted = weighted
+
+    def make_node(self, *inputs):
+        inputs = [pt.as_tensor_variable(v) for v in inputs]
+        n_params = 5 if self.moderated else 3
+        outputs = [inputs[i].type() for i in range(n_params)]
+        return Apply(self, inputs, outputs)
+
+    def perform(self, node, inputs, output_storage):
+        *inputs, g = inputs
+        beta, delta, gamma, theta, z, design, f, c, y, w = _split_inputs(
+            inputs, self.encoding, self.moderated, self.weighted
+        )
+        eta, products = utility_difference(
+            beta, delta, gamma, design, f, c, self.encoding, theta=theta, z=z, return_products=True
+        )
+        r = g * (y - expit(eta))
+        if w is not None:
+            r = w * r
+
+        n_countries = gamma.shape[0]
+        n_moderators = 0 if theta is None else theta.shape[0]
+        weights = np.zeros((len(r), 2 + n_countries + n_moderators))
+        weights[:, 0] = r
+        weights[:, 1] = f * r
+        weights[np.arange(len(r)), 2 + c] = r
+        if theta is not None:
+            weights[:, 2 + n_countries:] = z * r[:, None]
+
+        grads = design_transpose_products(weights, design, self.encoding, len(beta))
+
+        dtype = node.outputs[0].dtype
+        output_storage[0][0] = np.asarray(grads[0], dtype=dtype)
+        output_storage[1][0] = np.asarray(grads[1], dtype=dtype)
+        output_storage[2][0] = np.asarray(grads[2:2 + n_countries], dtype=dtype)
+        if theta is not None:
+            output_storage[3][0] = np.asarray(grads[2 + n_countries:], dtype=dtype)
+            output_storage[4][0] = np.asarray(products[:, 2 + n_countries:] * r[:, None], dtype=dtype)
+
+class PairedLogitLogLike(Op):
+    """
+    Log-likelihood of the observed left/right choices, per task.
+    Inputs are the coefficients beta (level), delta (level) and gamma
+    (country x level), if moderated theta (moderator x level) and the
+    moderators z (task x moderator), then the design (x_diff for "dummies",
+    the left and right level indices for "index"), framing f, country index
+    c and choice of left y (task), and if weighted the task weights w.
+    """
+    __props__ = ("encoding", "moderated", "weighted")
+
+    def __init__(self, encoding="dummies", moderated=False, weighted=False):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding should be one of {ENCODINGS}.")
+        self.encoding = encoding
+        self.moderated = moderated
+        self.weighted = weighted
+
+    def make_node(self, *inputs):
+        inputs = [pt.as_tensor_variable(v) for v in inputs]
+        outputs = [pt.vector(dtype=inputs[0].dtype)]
+        return Apply(self, inputs, outputs)
+
+    def perform(self, node, inputs, output_storage):
+        beta, delta, gamma, theta, z, design, f, c, y, w = _split_inputs(
+            inputs, self.encoding, self.moderated, self.weighted
+        )
+        eta = utility_difference(beta, delta, gamma, design, f, c, self.encoding, theta=theta, z=z)
+        # log_sigmoid(eta) for left choices, log_sigmoid(-eta) for right ones
+        loglike = log_expit(np.where(y == 1, eta, -eta))
+        if w is not None:
+            loglike = w * loglike
+        output_storage[0][0] = np.asarray(loglike, dtype=node.outputs[0].dtype)
+
+    def grad(self, inputs, output_gradients):
+        (g_out,) = output_gradients
+        param_grads = PairedLogitLogLikeGrad(self.encoding, self.moderated, self.weighted)(*inputs, g_out)
+        n_params = len(param_grads)
+        data_grads = [grad_not_implemented(self, i, inputs[i]) for i in range(n_params, len(inputs))]
+        return list(param_grads) + data_grads
+
+def paired_logit_task_loglike(beta, delta, gamma, *design_and_data, encoding="dummies",
+                              theta=None, z=None, weights=None):
+    """
+    Log-likelihood of the choices per task, see PairedLogitLogLike. Passing
+    theta and z adds the moderation z @ theta to the coefficients, passing
+    weights counts each task's log-likelihood that many times.
+    """
+    moderated = theta is not None
+    weighted = weights is not None
+    inputs = [beta, delta, gamma]
+    if moderated:
+        inputs += [theta, z]
+    inputs += list(design_and_data)
+    if weighted:
+        inputs.append(weights)
+    return PairedLogitLogLike(encoding, moderated=moderated, weighted=weighted)(*inputs)
+
+def paired_logit_loglike(beta, delta, gamma, *design_and_data, encoding="dummies",
+                         theta=None, z=None, weights=None):
+    """
+    Summed log-likelihood of the choices, e.g. for a pm.Potential of a
+    minibatch, see paired_logit_task_loglike.
+    """
+    return paired_logit_task_loglike(
+        beta, delta, gamma, *design_and_data, encoding=encoding, theta=theta, z=z, weights=weights
+    ).sum()
+
+def paired_logit_dist(name, beta, delta, gamma, *design, f, c, observed, encoding="dummies",
+                      theta=None, z=None, weights=None, **kwargs):
+    """
+    Observed choices of left (task) with the per-task log-likelihood of
+    PairedLogitLogLike as logp, as a pm.CustomDist. Tasks are the batch
+    dimension, so the pointwise log-likelihood is per task (per collapsed
+    task if weighted). Draws for predictive sampling are Bernoulli with
+    probability sigmoid(eta); a weighted task is drawn once. kwargs go to
+    pm.CustomDist, e.g. dims. Has to be called in a model context.
+    """
+    import pymc as pm
+
+    moderated = theta is not None
+    weighted = weights is not None
+    params = [beta, delta, gamma] + ([theta, z] if moderated else []) + list(design) + [f, c]
+    params += [weights] if weighted else []
+
+    # core dims: l levels, k countries, m moderators, a attributes; tasks are the batch
+    core = ["(l)", "(l)", "(k,l)"] + (["(m,l)", "(m)"] if moderated else [])
+    core += ["(l)"] if encoding == "dummies" else ["(a)", "(a)"]
+    core += ["()", "()"] + (["()"] if weighted else [])
+    signature = ",".join(core) + "->()"
+
+    op = PairedLogitLogLike(encoding, moderated=moderated, weighted=weighted)
+
+    # pymc broadcasts the coefficients to the task batch, the Op takes them once
+    n_coefs = 4 if moderated else 3
+    core_ndims = [1, 1, 2, 2][:n_coefs]
+
+    def core_params(params):
+        coefs = [p[(0,) * (p.ndim - ndim)] for p, ndim in zip(params, core_ndims)]
+        return coefs + list(params[n_coefs:])
+
+    def logp(value, *params):
+        params = core_params(params)
+        if weighted:
+            return op(*params[:-1], value, params[-1])
+        return op(*params, value)
+
+    def random(*params, rng=None, size=None):
+        params = core_params(params)
+        inputs = params[:-1] + [None, params[-1]] if weighted else params + [None]
+        beta, delta, gamma, theta, z, design, f, c, _, _ = _split_inputs(inputs, encoding, moderated, weighted)
+        eta = utility_difference(beta, delta, gamma, design, f, c, encoding, theta=theta, z=z)
+        return rng.binomial(1, expit(eta), size=size)
+
+    return pm.CustomDist(
+        name, *params, logp=logp, random=random, signature=signature, observed=observed, dtype="int64", **kwargs
+    )
+
+def register_jax():
+    """
+    Register a JAX implementation of PairedLogitLogLike, needed to sample
+    models using it with numpyro or blackjax. JAX computes the gradient
+    itself, so PairedLogitLogLikeGrad has none; tests/test_jax.py checks
+    its value and gradient against the numpy Op.
+    """
+    import jax
+    import jax.numpy as jnp
+    from pytensor.link.jax.dispatch import jax_funcify
+
+    @jax_funcify.register(PairedLogitLogLike)
+    def jax_funcify_paired_logit_loglike(op, **kwargs):
+        encoding = op.encoding
+        moderated = op.moderated
+        weighted = op.weighted
+
+        def paired_logit_loglike_jax(*inputs):
+            beta, delta, gamma, theta, z, design, f, c, y, w = _split_inputs(inputs, encoding, moderated, weighted)
+            eta = utility_difference(beta, delta, gamma, design, f, c, encoding, xp=jnp, theta=theta, z=z)
+            loglike = jax.nn.log_sigmoid(jnp.where(y == 1, eta, -eta))
+            if w is not None:
+                loglike = w * loglike
+            return loglike
+
+        return paired_logit_loglike_jax
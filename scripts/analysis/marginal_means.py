@@ -0,0 +1,474 @@
+import itertools
+import warnings
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from scripts.parallel import fork_map
+from scripts.preprocessing.countries import COUNTRIES, translated_table
+from scripts.preprocessing.storage import read_table
+
+# Marginal means and AMCEs
+#
+# The estimates of cregg::cj in scripts/hainmueller/*.R, computed in
+# Python. The marginal mean of a level is the share of profiles with that
+# level that were chosen. The AMCE of a level is its coefficient in a linear
+# regression of the choice on the dummies of all attributes, relative to
+# the attribute's baseline level. Standard errors are clustered by
+# respondent, with the G / (G - 1) correction for G respondents of the
+# survey package that cregg uses. With `by`, each subgroup is estimated on
+# its own, like cregg splits the data.
+#
+# Subgroups, levels and respondents are integer codes, so all subgroups of
+# a grouping come out of a few np.bincount sums per attribute instead of
+# one model per subgroup.
+#
+# subgroup_sweep runs the marginal means for every combination of
+# moderators in a sweep configuration. Moderators that are fixed per
+# respondent (country, framing, value bins) only decide which subgroup a
+# respondent's statistics go to. So the profiles are summed once per
+# attribute and conditioning attribute, and every grouping is a sum over
+# respondents.
+#
+# cluster_bootstrap resamples respondents. The profiles and chosen profiles
+# of each respondent per subgroup and level are summed once; a bootstrap
+# replicate then only reweights respondents, so a chunk of replicates is
+# one product of a (replicate x respondent) matrix of multinomial counts
+# with these sums.
+
+INTERVAL = 0.95
+
+# tercile bins of the value indices, as in values_effect.R
+VALUE_BINS = {
+    "lreco_bin": ("lreco", ["Left", "Mid", "Right"]),
+    "galtan_bin": ("galtan", ["Alternative", "Neither", "Conservative"]),
+    "ecol_bin": ("socio_ecol", ["High concern", "Mid concern", "Low concern"]),
+}
+
+def value_bins(values, bins=VALUE_BINS, probs=(0, 0.33, 0.67, 1)):
+    """
+    Add the binned value indices, cut at the quantiles over all respondents
+    (R's cut of quantile with include.lowest). Missing indices stay missing.
+    """
+    values = values.copy()
+    for name, (index, labels) in bins.items():
+        breaks = values[index].astype(float).quantile(list(probs)).values
+        values[name] = pd.cut(values[index], breaks, labels=labels, include_lowest=True)
+    return values
+
+def load_conjoint(values=True):
+    """
+    The translated conjoint tables of all countries, one row per profile,
+    with the country's name and, if values, the value indices and their
+    bins joined by respondent.
+    """
+    df = pd.concat(
+        [read_table(translated_table(code)).assign(country=config["name"]) for code, config in COUNTRIES.items()],
+        ignore_index=True,
+    )
+    for col in df.columns:
+        if col.startswith("attr_") or col in ["framing", "country"]:
+            df[col] = df[col].astype("category")
+
+    if values:
+        value_indices = value_bins(read_table("data_values_ch_cn"))
+        value_columns = ["id", "country", "lreco", "galtan", "socio_ecol"] + list(VALUE_BINS)
+        df = df.merge(value_indices[value_columns], on=["id", "country"], how="left")
+    return df
+
+def _codes(values):
+    """
+    Integer codes and labels of a column, in category order for categoricals
+    and sorted otherwise. Missing values get -1.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.values.astype(np.int64), list(values.cat.categories)
+    codes, labels = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), list(labels)
+
+def _group_sum(codes, values, n_groups):
+    """
+    Sums of the rows of values (n x k) per code, as (n_groups x k).
+    """
+    values = np.asarray(values, dtype=float).reshape(len(codes), -1)
+    k = values.shape[1]
+    keys = (codes[:, None] * k + np.arange(k)).ravel()
+    return np.bincount(keys, values.ravel(), minlength=n_groups * k).reshape(n_groups, k)
+
+def _prepare(df, by, id, outcome):
+    """
+    Rows with an outcome and all `by` values, with their subgroup codes, the
+    subgroup table, and a code per respondent within subgroup (cluster).
+    """
+    by = list(by or [])
+    df = df[df[outcome].notna()]
+    if by:
+        df = df.dropna(subset=by)
+        grouped = df.groupby(by, observed=True, sort=True)
+        group = grouped.ngroup().values
+        groups = grouped.size().index.to_frame(index=False)
+    else:
+        group = np.zeros(len(df), dtype=np.int64)
+        groups = pd.DataFrame(index=[0])
+
+    id_codes, _ = pd.factorize(df[id])
+    cluster, cluster_keys = pd.factorize(group * (id_codes.max() + 1) + id_codes)
+    cluster_group = np.asarray(cluster_keys) // (id_codes.max() + 1)
+    n_clusters = np.bincount(cluster_group, minlength=len(groups))
+
+    return {
+        "df": df,
+        "group": group.astype(np.int64),
+        "groups": groups,
+        "cluster": cluster.astype(np.int64),
+        "cluster_group": cluster_group.astype(np.int64),
+        "n_clusters": n_clusters,
+        "y": df[outcome].values.astype(float),
+    }
+
+def _columns(estimate, statistic, feature, labels, std_error, n, interval, h0):
+    """
+    Result columns for every subgroup and level of a feature, flattened from
+    (subgroup x level) arrays.
+    """
+    n_groups, n_levels = estimate.shape
+    z_crit = ndtri(0.5 + interval / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = ((estimate - h0) / std_error).ravel()
+    return {
+        "statistic": np.full(estimate.size, statistic, dtype=object),
+        "feature": np.full(estimate.size, feature, dtype=object),
+        "level": np.tile(np.asarray(labels, dtype=object), n_groups),
+        "estimate": estimate.ravel(),
+        "std_error": std_error.ravel(),
+        "z": z,
+        "p": 2 * ndtr(-np.abs(z)),
+        "lower": (estimate - z_crit * std_error).ravel(),
+        "upper": (estimate + z_crit * std_error).ravel(),
+        "n": n.ravel(),
+    }
+
+def _tidy(groups, estimate, statistic, feature, labels, std_error, n, interval, h0):
+    """
+    One row per subgroup (a row of groups) and level of a feature.
+    """
+    result = pd.DataFrame(_columns(estimate, statistic, feature, labels, std_error, n, interval, h0))
+    groups = groups.loc[groups.index.repeat(estimate.shape[1])].reset_index(drop=True)
+    return pd.concat([groups, result], axis=1) if len(groups.columns) else result
+
+def _cluster_means(count, total, cluster_group, n_groups):
+    """
+    Marginal means and clustered standard errors per subgroup and level from
+    the sufficient statistics of each cluster: the number of profiles and
+    chosen profiles per level (cluster x level), and the cluster's subgroup.
+    Returns estimate, std_error and n as (subgroup x level).
+    """
+    n = _group_sum(cluster_group, count, n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimate = _group_sum(cluster_group, total, n_groups) / n
+
+        # sum of each cluster's residuals per level, squared and summed per subgroup
+        residual = total - np.nan_to_num(estimate)[cluster_group] * count
+        squares = _group_sum(cluster_group, residual ** 2, n_groups)
+        n_clusters = np.bincount(cluster_group, minlength=n_groups)
+        correction = n_clusters / np.maximum(n_clusters - 1, 1)
+        std_error = np.sqrt(correction[:, None] * squares) / n
+    return estimate, std_error, n.astype(np.int64)
+
+def marginal_means(df, features, by=None, id="id", outcome="chosen", interval=INTERVAL, h0=0):
+    """
+    Marginal means of every level of the features, per subgroup of `by`,
+    with respondent-clustered standard errors and normal intervals, like
+    cj(..., estimate = "mm"). Returns one row per subgroup, feature and
+    level; levels missing from a subgroup have n = 0 and NaN estimates.
+    """
+    data = _prepare(df, by, id, outcome)
+    y, cluster = data["y"], data["cluster"]
+    n_clusters = len(data["cluster_group"])
+
+    results = []
+    for feature in features:
+        level, labels = _codes(data["df"][feature])
+        n_levels = len(labels)
+        keep = level >= 0
+
+        # profiles and chosen profiles per respondent and level
+        cell = cluster[keep] * n_levels + level[keep]
+        count = np.bincount(cell, minlength=n_clusters * n_levels).reshape(n_clusters, n_levels)
+        total = np.bincount(cell, y[keep], minlength=n_clusters * n_levels).reshape(n_clusters, n_levels)
+
+        estimate, std_error, n = _cluster_means(count, total, data["cluster_group"], len(data["groups"]))
+        results.append(_tidy(data["groups"], estimate, "mm", feature, labels, std_error, n, interval, h0))
+
+    return pd.concat(results, ignore_index=True)
+
+def amce(df, features, by=None, baselines=None, id="id", outcome="chosen", interval=INTERVAL):
+    """
+    Average marginal component effects of every level of the features, per
+    subgroup of `by`, from one regression of the outcome on the dummies of
+    all features, with respondent-clustered standard errors, like
+    cj(..., estimate = "amce"). baselines gives the reference level per
+    feature, by default the first. Baselines are included with estimate 0.
+    """
+    data = _prepare(df, by, id, outcome)
+    keep = np.ones(len(data["df"]), dtype=bool)
+    codes, labels = {}, {}
+    for feature in features:
+        codes[feature], labels[feature] = _codes(data["df"][feature])
+        keep &= codes[feature] >= 0
+    if not keep.all():
+        data = _prepare(data["df"][keep], by, id, outcome)
+        codes = {feature: _codes(data["df"][feature])[0] for feature in features}
+
+    y, group, cluster = data["y"], data["group"], data["cluster"]
+    n_groups, n_clusters = len(data["groups"]), data["n_clusters"]
+
+    # intercept and one dummy per non-baseline level
+    columns = [np.ones(len(y))]
+    dummies = {}
+    for feature in features:
+        baseline = labels[feature].index(baselines[feature]) if baselines else 0
+        dummies[feature] = [l for l in range(len(labels[feature])) if l != baseline]
+        columns += [(codes[feature] == l).astype(float) for l in dummies[feature]]
+    X = np.column_stack(columns)
+    p = X.shape[1]
+
+    # least squares per subgroup from the summed cross products
+    xtx = _group_sum(group, X[:, :, None] * X[:, None, :], n_groups).reshape(n_groups, p, p)
+    xty = _group_sum(group, X * y[:, None], n_groups)
+    bread = np.linalg.pinv(xtx)
+    coefs = np.einsum("gij,gj->gi", bread, xty)
+
+    # clustered sandwich: scores summed per respondent, outer products per subgroup
+    residual = y - (X * coefs[group]).sum(axis=1)
+    scores = _group_sum(cluster, X * residual[:, None], len(data["cluster_group"]))
+    meat = _group_sum(data["cluster_group"], scores[:, :, None] * scores[:, None, :], n_groups).reshape(n_groups, p, p)
+    correction = n_clusters / np.maximum(n_clusters - 1, 1)
+    vcov = correction[:, None, None] * bread @ meat @ bread
+    std_errors = np.sqrt(np.maximum(np.diagonal(vcov, axis1=1, axis2=2), 0))
+
+    results = []
+    column = 1
+    for feature in features:
+        level = codes[feature]
+        n_levels = len(labels[feature])
+        n = np.bincount(group * n_levels + level, minlength=n_groups * n_levels).reshape(n_groups, n_levels)
+        estimate = np.zeros((n_groups, n_levels))
+        std_error = np.full((n_groups, n_levels), np.nan)
+        for l in dummies[feature]:
+            estimate[:, l] = coefs[:, column]
+            std_error[:, l] = std_errors[:, column]
+            column += 1
+        # levels absent from a subgroup are not identified
+        estimate[n == 0] = np.nan
+        std_error[n == 0] = np.nan
+        results.append(_tidy(data["groups"], estimate, "amce", feature, labels[feature], std_error, n, interval, 0))
+
+    return pd.concat(results, ignore_index=True)
+
+def _table(results):
+    """
+    One table from the result columns of several groupings; moderators
+    outside a grouping are empty.
+    """
+    names = list(dict.fromkeys(name for columns in results for name in columns))
+    return pd.DataFrame({
+        name: np.concatenate([
+            columns.get(name, np.full(len(columns["level"]), None, dtype=object)) for columns in results
+        ])
+        for name in names
+    })
+
+def sweep_groupings(sweep):
+    """
+    All groupings of a sweep configuration, a dict of slots with the
+    moderators to choose from. A grouping takes at most one moderator per
+    slot, or none.
+    """
+    options = [[None] + list(moderators) for moderators in sweep.values()]
+    return [[m for m in choice if m is not None] for choice in itertools.product(*options)]
+
+def _sweep_job(y, respondent, respondent_codes, interval, job):
+    """
+    Marginal means of one feature for all groupings with the same
+    conditioning attribute (or None), from the profiles and chosen profiles
+    per respondent, conditioning level and feature level.
+    """
+    feature, (level, labels), condition, condition_codes, groupings = job
+    n_respondents = respondent.max() + 1
+    condition_code, condition_labels = condition_codes if condition else (np.zeros_like(level), [None])
+    n_levels, n_conditions = len(labels), len(condition_labels)
+    keep = (level >= 0) & (condition_code >= 0)
+
+    # one unit per respondent and conditioning level, the clusters of a grouping
+    unit = respondent[keep] * n_conditions + condition_code[keep]
+    cell = unit * n_levels + level[keep]
+    n_units = n_respondents * n_conditions
+    count = np.bincount(cell, minlength=n_units * n_levels).reshape(n_units, n_levels)
+    total = np.bincount(cell, y[keep], minlength=n_units * n_levels).reshape(n_units, n_levels)
+    unit_respondent = np.repeat(np.arange(n_respondents), n_conditions)
+    unit_condition = np.tile(np.arange(n_conditions), n_respondents)
+    present = count.sum(axis=1) > 0
+
+    results = []
+    for by in groupings:
+        codes, labels_by = [], []
+        for moderator in by:
+            if moderator == condition:
+                codes.append(unit_condition)
+                labels_by.append(condition_labels)
+            else:
+                codes.append(respondent_codes[moderator][0][unit_respondent])
+                labels_by.append(respondent_codes[moderator][1])
+        valid = present & np.all([code >= 0 for code in codes], axis=0)
+
+        # subgroups that have profiles, in the order of the moderators' levels
+        shape = [len(l) for l in labels_by]
+        if by:
+            key = np.ravel_multi_index([code[valid] for code in codes], shape)
+        else:
+            key = np.zeros(valid.sum(), dtype=np.int64)
+        observed, group = np.unique(key, return_inverse=True)
+
+        estimate, std_error, n = _cluster_means(count[valid], total[valid], group, len(observed))
+        columns = _columns(estimate, "mm", feature, labels, std_error, n, interval, 0)
+        columns["grouping"] = np.full(estimate.size, "+".join(by), dtype=object)
+        indices = np.unravel_index(observed, shape) if by else []
+        for moderator, labels_m, index in zip(by, labels_by, indices):
+            columns[moderator] = np.repeat(np.asarray(labels_m, dtype=object)[index], n_levels)
+        results.append(columns)
+
+    return _table(results)
+
+def subgroup_sweep(df, features, sweep, id="id", outcome="chosen", interval=INTERVAL, processes=None):
+    """
+    Marginal means of the features for every grouping of the sweep (see
+    sweep_groupings), as one table with a grouping column and one column
+    per moderator, empty where the grouping does not use it. Respondents
+    with a missing moderator are left out of the groupings that use it.
+
+    A grouping may hold one moderator that varies within respondents, an
+    attribute to condition on; groupings that condition a feature on itself
+    are skipped. The features run in parallel processes.
+    """
+    df = df[df[outcome].notna()]
+    respondent, _ = pd.factorize(df[id])
+    groupings = sweep_groupings(sweep)
+    moderators = list(dict.fromkeys(m for slot in sweep.values() for m in slot))
+
+    # moderators fixed per respondent are coded per respondent
+    first = df.groupby(respondent, sort=True).first()
+    fixed = df.groupby(respondent, sort=True)[moderators].nunique(dropna=False).max() <= 1
+    respondent_codes = {m: _codes(first[m]) for m in moderators if fixed[m]}
+    varying = [m for m in moderators if not fixed[m]]
+    for by in groupings:
+        if len(set(by) & set(varying)) > 1:
+            raise ValueError(f"Grouping {by} has more than one moderator that varies within respondents.")
+
+    jobs = []
+    for feature in features:
+        for condition in [None] + varying:
+            selected = [
+                by for by in groupings
+                if feature not in by and (condition in by if condition else not set(by) & set(varying))
+            ]
+            if selected:
+                condition_codes = _codes(df[condition]) if condition else None
+                jobs.append((feature, _codes(df[feature]), condition, condition_codes, selected))
+
+    y = df[outcome].values.astype(float)
+    sweep_job = partial(_sweep_job, y, respondent.astype(np.int64), respondent_codes, interval)
+    results = fork_map(sweep_job, jobs, processes)
+
+    result = pd.concat(results, ignore_index=True)
+    return result[["grouping"] + moderators + [col for col in result.columns if col not in moderators + ["grouping"]]]
+
+def _bootstrap_chunk(count, total, job):
+    """
+    Marginal means (replicate x column) of a chunk of bootstrap replicates,
+    each drawing the respondents with replacement.
+    """
+    seed, size = job
+    n_respondents = count.shape[0]
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(n_respondents, np.full(n_respondents, 1 / n_respondents), size=size).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ((weights @ total) / (weights @ count)).astype(np.float32)
+
+def cluster_bootstrap(df, features, groupings=None, n_boot=1000, id="id", outcome="chosen",
+                      interval=INTERVAL, chunk_size=500, processes=None, random_seed=42):
+    """
+    Marginal means of the features per subgroup of each grouping (lists of
+    `by` columns, by default none) with percentile intervals from a
+    bootstrap over respondents, as one table like subgroup_sweep. std_error
+    is the standard deviation of the replicates. Chunks of chunk_size
+    replicates run in parallel processes; the replicates do not depend on
+    the number of processes. Memory is n_boot x (subgroups x levels).
+    """
+    df = df[df[outcome].notna()]
+    respondent, _ = pd.factorize(df[id])
+    n_respondents = respondent.max() + 1
+    y = df[outcome].values.astype(float)
+    if groupings is None:
+        groupings = [[]]
+
+    # one column per grouping, feature, subgroup and level
+    rows, columns, values, parts = [], [], [], []
+    offset = 0
+    for by in groupings:
+        if by:
+            grouped = df.groupby(by, observed=True, sort=True, dropna=True)
+            group = grouped.ngroup().values
+            groups = grouped.size().index.to_frame(index=False)
+        else:
+            group = np.zeros(len(df), dtype=np.int64)
+            groups = pd.DataFrame(index=[0])
+        for feature in features:
+            if feature in by:
+                continue
+            level, labels = _codes(df[feature])
+            keep = (group >= 0) & (level >= 0)
+            rows.append(respondent[keep])
+            columns.append(offset + group[keep] * len(labels) + level[keep])
+            values.append(y[keep])
+            parts.append((by, feature, labels, groups, offset))
+            offset += len(groups) * len(labels)
+
+    # profiles and chosen profiles per respondent and column
+    keys = np.concatenate(rows) * offset + np.concatenate(columns)
+    count = np.bincount(keys, minlength=n_respondents * offset).reshape(n_respondents, offset).astype(float)
+    total = np.bincount(keys, np.concatenate(values), minlength=n_respondents * offset).reshape(n_respondents, offset)
+
+    seeds = np.random.SeedSequence(random_seed).spawn(-(-n_boot // chunk_size))
+    jobs = [(seed, min(chunk_size, n_boot - i * chunk_size)) for i, seed in enumerate(seeds)]
+    replicates = np.concatenate(fork_map(partial(_bootstrap_chunk, count, total), jobs, processes))
+
+    tail = (1 - interval) / 2
+    n = count.sum(axis=0).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimate = total.sum(axis=0) / n
+    with warnings.catch_warnings():
+        # subgroups without profiles in some replicates
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lower, upper = np.nanquantile(replicates, [tail, 1 - tail], axis=0).astype(float)
+        std_error = np.nanstd(replicates, axis=0, ddof=1).astype(float)
+
+    results = []
+    for by, feature, labels, groups, start in parts:
+        shape = (len(groups), len(labels))
+        cols = slice(start, start + shape[0] * shape[1])
+        result = _columns(
+            estimate[cols].reshape(shape), "mm", feature, labels,
+            std_error[cols].reshape(shape), n[cols].reshape(shape), interval, 0,
+        )
+        result["lower"], result["upper"] = lower[cols], upper[cols]
+        result["grouping"] = np.full(len(result["level"]), "+".join(by), dtype=object)
+        for moderator in by:
+            result[moderator] = np.repeat(groups[moderator].values.astype(object), shape[1])
+        results.append(result)
+
+    result = _table(results)
+    moderators = list(dict.fromkeys(m for by in groupings for m in by))
+    return result[["grouping"] + moderators + [col for col in result.columns if col not in moderators + ["grouping"]]]
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.analysis.design import level_categories, level_index_design
+from scripts.preprocessing.storage import file_hash, read_table, table_path
+
+CACHE_DIR = "data/model_inputs"
+
+# bump when the arrays built below change, so old bundles are not reused
+BUNDLE_VERSION = 3
+
+# arrays with one entry per task, collapsed by deduplicate_tasks
+TASK_ARRAYS = [
+    "f", "c", "observed_choice_left", "individual_idx",
+    "level_index_left", "level_index_right",
+    "attribute_levels_left", "attribute_levels_right", "attribute_levels_diff",
+]
+
+def deduplicate_tasks(inputs, by_individual=True):
+    """
+    Collapse tasks with the same design, framing, country and choice into
+    one task with weight the number of copies, keeping the first copy's
+    position. With by_individual only tasks of the same respondent are
+    collapsed, as needed when the model has respondent-level terms; without
+    it individual_idx is dropped.
+    """
+    task_arrays = [name for name in TASK_ARRAYS if name in inputs]
+    if not by_individual:
+        task_arrays.remove("individual_idx")
+
+    n_tasks = len(inputs["f"])
+    key = np.column_stack([np.asarray(inputs[name]).reshape(n_tasks, -1) for name in task_arrays])
+    _, first, counts = np.unique(key, axis=0, return_index=True, return_counts=True)
+    order = np.argsort(first)
+
+    deduplicated = {name: values for name, values in inputs.items() if name not in TASK_ARRAYS}
+    for name in task_arrays:
+        deduplicated[name] = inputs[name][first[order]]
+    deduplicated["weight"] = counts[order].astype(np.float64)
+    return deduplicated
+
+def build_model_inputs(df, attributes, baseline_dict, drop_first=False, encoding="index", traits=None,
+                       deduplicate=False):
+    """
+    Build the arrays and coords the choice models need from the long data:
+    the design of the left (package 1) and right (package 2) packages, framing
+    f, country index c, observed choice of left and the individual index,
+    one entry per task.
+
+    With encoding "index" the design is level_index_left/right (task x
+    attribute), with "dummies" it is attribute_levels_left/right and their
+    difference attribute_levels_diff (task x level).
+
+    traits maps each latent trait to its indicator columns. Indicators are
+    answered once per respondent, so they are taken from the respondent's
+    first row and flattened to the observed answers only: indicator_value,
+    indicator_individual, indicator_item and indicator_trait, with the
+    trait of each item in item_trait.
+
+    Framing and country are constant per respondent and are also returned
+    per respondent, as respondent_f and respondent_c (individual). With
+    deduplicate, identical tasks are collapsed into weighted ones, see
+    deduplicate_tasks; tasks are only collapsed within respondents if there
+    are traits.
+    """
+    df = df.copy()
+
+    # reorder each attribute column by making it categorical with the baseline first
+    categories = level_categories(df, attributes, baseline_dict)
+    for attr in attributes:
+        df[attr] = pd.Categorical(df[attr], categories=categories[attr], ordered=True)
+
+    df["framing"] = df["framing"].astype("category")
+    df["country"] = df["country"].astype("category")
+
+    left = (df.package == 1).to_numpy()
+    right = (df.package == 2).to_numpy()
+
+    # individuals in order of appearance
+    individual_codes, unique_individuals = pd.factorize(df["id"])
+    first_rows = ~df["id"].duplicated().to_numpy()
+
+    inputs = {
+        "f": df["framing"].cat.codes.to_numpy()[left],
+        "c": df["country"].cat.codes.to_numpy()[left],
+        "observed_choice_left": df["chosen"].to_numpy(dtype=np.int64)[left],
+        "individual_idx": individual_codes[left],
+        "respondent_f": df["framing"].cat.codes.to_numpy()[first_rows],
+        "respondent_c": df["country"].cat.codes.to_numpy()[first_rows],
+    }
+
+    if encoding == "index":
+        level_names, level_index = level_index_design(df, attributes, baseline_dict, drop_first=drop_first)
+        inputs["level_index_left"] = level_index[left]
+        inputs["level_index_right"] = level_index[right]
+    elif encoding == "dummies":
+        dummies = pd.get_dummies(df[attributes], drop_first=drop_first)
+
+        # baseline first for each attribute, unless it is dropped
+        ordered_columns = []
+        for attr in attributes:
+            levels = categories[attr][1:] if drop_first else categories[attr]
+            ordered_columns.extend(f"{attr}_{level}" for level in levels)
+        dummies = dummies[ordered_columns].to_numpy(dtype=np.int8)
+
+        level_names = ordered_columns
+        inputs["attribute_levels_left"] = dummies[left]
+        inputs["attribute_levels_right"] = dummies[right]
+        inputs["attribute_levels_diff"] = dummies[left] - dummies[right]
+    else:
+        raise ValueError("encoding should be 'index' or 'dummies'.")
+
+    if traits:
+        items = [item for trait_items in traits.values() for item in trait_items]
+        item_traits = [j for j, trait_items in enumerate(traits.values()) for _ in trait_items]
+
+        # one row per respondent, in the order of unique_individuals
+        values = df.loc[first_rows, items].to_numpy(dtype=np.float32)
+        individual, item = np.nonzero(~np.isnan(values))
+
+        inputs["indicator_value"] = values[individual, item]
+        inputs["indicator_individual"] = individual
+        inputs["indicator_item"] = item
+        inputs["indicator_trait"] = np.asarray(item_traits)[item]
+        inputs["item_trait"] = np.asarray(item_traits)
+
+    if deduplicate:
+        inputs = deduplicate_tasks(inputs, by_individual=bool(traits))
+
+    inputs["coords"] = {
+        "level": list(level_names),
+        "attribute": list(attributes),
+        "task": list(range(len(inputs["f"]))),
+        "framing": list(df["framing"].cat.categories),
+        "country": list(df["country"].cat.categories),
+        "individual": unique_individuals.tolist(),
+    }
+    if traits:
+        inputs["coords"]["trait"] = list(traits)
+        inputs["coords"]["item"] = items
+    return inputs
+
+def pad_by_respondent(inputs):
+    """
+    Task and indicator arrays laid out per respondent, so that minibatches
+    of respondents keep all of a respondent's tasks and answers together.
+    Task arrays become (individual x max tasks x ...), padded with tasks of
+    weight 0 whose levels point to the zero coefficient (index) or are all
+    zero (dummies). Indicators become an (individual x item) matrix of
+    values with an indicator_mask of the observed answers.
+    """
+    individual_idx = np.asarray(inputs["individual_idx"])
+    n_individuals = len(inputs["coords"]["individual"])
+    n_levels = len(inputs["coords"]["level"])
+
+    # position of each task among its respondent's tasks
+    order = np.argsort(individual_idx, kind="stable")
+    counts = np.bincount(individual_idx, minlength=n_individuals)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.empty_like(individual_idx)
+    position[order] = np.arange(len(individual_idx)) - starts[individual_idx[order]]
+
+    padded = {"individual": np.arange(n_individuals)}
+    weight = inputs.get("weight", np.ones(len(individual_idx)))
+    for name in TASK_ARRAYS + ["weight"]:
+        if name == "individual_idx" or (name not in inputs and name != "weight"):
+            continue
+        values = np.asarray(weight if name == "weight" else inputs[name])
+        fill = n_levels if name.startswith("level_index") else 0
+        array = np.full((n_individuals, counts.max()) + values.shape[1:], fill, dtype=values.dtype)
+        array[individual_idx, position] = values
+        padded[name] = array
+
+    if "indicator_value" in inputs:
+        n_items = len(inputs["coords"]["item"])
+        values = np.zeros((n_individuals, n_items), dtype=np.float32)
+        mask = np.zeros((n_individuals, n_items), dtype=np.float32)
+        values[inputs["indicator_individual"], inputs["indicator_item"]] = inputs["indicator_value"]
+        mask[inputs["indicator_individual"], inputs["indicator_item"]] = 1
+        padded["indicator_value"] = values
+        padded["indicator_mask"] = mask
+        padded["item_trait"] = inputs["item_trait"]
+
+    return padded
+
+def _bundle_key(path, config):
+    digest = hashlib.sha256()
+    digest.update(file_hash(path).encode())
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+def load_model_inputs(attributes, baseline_dict, drop_first=False, encoding="index", traits=None,
+                      deduplicate=False, max_respondents=None, table="hcm_input", cache_dir=CACHE_DIR):
+    """
+    Model inputs for the given attributes and baselines, built from the table
+    once and then loaded from a bundle of memory-mapped .npy files. Bundles
+    are keyed on the hash of the input file and the configuration, so a
+    changed input or configuration builds a new bundle.
+
+    max_respondents keeps only the first respondents, e.g. for quick tests.
+    The bundle key is returned as inputs["bundle"], e.g. to tell the
+    checkpoints of sampling.sample_checkpointed apart.
+    """
+    path = table_path(table)
+    config = {
+        "version": BUNDLE_VERSION,
+        "table": table,
+        "attributes": list(attributes),
+        "baselines": {attr: baseline_dict[attr] for attr in attributes},
+        "drop_first": drop_first,
+        "encoding": encoding,
+        "traits": traits,
+        "deduplicate": deduplicate,
+        "max_respondents": max_respondents,
+    }
+    bundle = _bundle_key(path, config)
+    bundle_dir = os.path.join(cache_dir, bundle)
+    coords_file = os.path.join(bundle_dir, "coords.json")
+
+    if os.path.exists(coords_file):
+        with open(coords_file) as f:
+            inputs = {"coords": json.load(f)}
+        for file_name in os.listdir(bundle_dir):
+            if file_name.endswith(".npy"):
+                inputs[file_name[:-4]] = np.load(os.path.join(bundle_dir, file_name), mmap_mode="r")
+        inputs["bundle"] = bundle
+        return inputs
+
+    columns = ["id", "package", "chosen", "framing", "country"] + list(attributes)
+    if traits:
+        columns += [item for trait_items in traits.values() for item in trait_items]
+    df = read_table(table, columns=columns)
+    if max_respondents is not None:
+        df = df[df["id"].isin(df["id"].unique()[:max_respondents])]
+
+    inputs = build_model_inputs(
+        df, attributes, baseline_dict, drop_first=drop_first, encoding=encoding, traits=traits,
+        deduplicate=deduplicate,
+    )
+
+    # write to a temporary directory first, so an interrupted build is not reused
+    tmp_dir = bundle_dir + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, values in inputs.items():
+        if name != "coords":
+            np.save(os.path.join(tmp_dir, name + ".npy"), values)
+    with open(os.path.join(tmp_dir, "coords.json"), "w") as f:
+        json.dump(inputs["coords"], f, default=str)
+    os.replace(tmp_dir, bundle_dir)
+
+    inputs["bundle"] = bundle
+    return inputs
@@ -0,0 +1,222 @@
+from scripts.analysis.design import ENCODINGS
+
+# Choice models
+#
+# The pymc models of basic_choice_model.py and hybrid_choice_model.py, built
+# from the arrays of model_inputs.load_model_inputs. The basic model has
+# main effects of the attribute levels (beta), framing shifts (delta) and
+# country effects (gamma). The hybrid model adds latent traits per
+# respondent, measured by the Likert indicators, that moderate the level
+# effects (theta).
+#
+# likelihood "paired_logit" uses the custom log-likelihood Op with analytic
+# gradient as the logp of the observed choices, "bernoulli" the original
+# exp(u_l) / (exp(u_l) + exp(u_r)) formulation, which needs the "dummies"
+# encoding and no deduplication.
+# pymc is imported when a model is built.
+
+LIKELIHOODS = ["paired_logit", "bernoulli"]
+
+def _check_settings(likelihood, encoding, deduplicate):
+    if likelihood not in LIKELIHOODS:
+        raise ValueError(f"likelihood should be one of {LIKELIHOODS}.")
+    if encoding not in ENCODINGS:
+        raise ValueError(f"encoding should be one of {ENCODINGS}.")
+    if likelihood == "bernoulli" and (encoding != "dummies" or deduplicate):
+        raise ValueError("The bernoulli likelihood needs ENCODING = 'dummies' and DEDUPLICATE = False.")
+
+def _design_data(inputs, encoding):
+    """
+    The left and right packages as pm.Data, and the design the likelihood
+    takes. Has to be called in a model context.
+    """
+    import pymc as pm
+
+    if encoding == "index":
+        # level index of each attribute
+        attribute_levels_left = pm.Data(
+            "level_index_left", inputs["level_index_left"], dims=["task", "attribute"]
+        )
+        attribute_levels_right = pm.Data(
+            "level_index_right", inputs["level_index_right"], dims=["task", "attribute"]
+        )
+        return attribute_levels_left, attribute_levels_right, [attribute_levels_left, attribute_levels_right]
+
+    # attribute dummies
+    attribute_levels_left = pm.Data(
+        "attribute_levels_left", inputs["attribute_levels_left"], dims=["task", "level"]
+    )
+    attribute_levels_right = pm.Data(
+        "attribute_levels_right", inputs["attribute_levels_right"], dims=["task", "level"]
+    )
+
+    # difference of left and right dummies, the likelihood only needs this
+    design = [pm.Data("attribute_levels_diff", inputs["attribute_levels_diff"], dims=["task", "level"])]
+    return attribute_levels_left, attribute_levels_right, design
+
+def _choice_likelihood(likelihood, encoding, store_deterministics, beta, delta, gamma, f, c,
+                       attribute_levels_left, attribute_levels_right, design,
+                       observed_choice_left, weight, theta=None, z=None):
+    """
+    Likelihood of the observed choices, and the per-task utilities and
+    choice probabilities if store_deterministics. Has to be called in a
+    model context.
+    """
+    import pymc as pm
+
+    from scripts.analysis.likelihood import paired_logit_dist, task_utility
+
+    if likelihood == "bernoulli":
+        # compute modified coefficients depending on framing
+        # this gives beta + delta * framing per task and level
+        # adding country effect, and the latent traits' moderation
+        beta_framed = beta + delta * f[:, None] + gamma[c, :]
+        if theta is not None:
+            beta_framed = beta_framed + pm.math.dot(z, theta)
+
+        # compute utility
+        utility_left = pm.math.sum(attribute_levels_left * beta_framed, axis=1)
+        utility_right = pm.math.sum(attribute_levels_right * beta_framed, axis=1)
+
+        # choice probability via logit
+        probability_choice_left = pm.math.exp(utility_left) / (pm.math.exp(utility_left) + pm.math.exp(utility_right))
+
+        if store_deterministics:
+            pm.Deterministic("utility_left", utility_left, dims="task")
+            pm.Deterministic("utility_right", utility_right, dims="task")
+            probability_choice_left = pm.Deterministic(
+                "probability_choice_left", probability_choice_left, dims="task"
+            )
+
+        # likelihood
+        return pm.Bernoulli("choice_distribution", p=probability_choice_left, observed=observed_choice_left)
+
+    if store_deterministics:
+        # compute utility without the per-task coefficient matrix
+        utility_left = pm.Deterministic(
+            "utility_left",
+            task_utility(attribute_levels_left, beta, delta, gamma, f, c, encoding=encoding, theta=theta, z=z),
+            dims="task",
+        )
+        utility_right = pm.Deterministic(
+            "utility_right",
+            task_utility(attribute_levels_right, beta, delta, gamma, f, c, encoding=encoding, theta=theta, z=z),
+            dims="task",
+        )
+
+        # choice probability via logit
+        pm.Deterministic("probability_choice_left", pm.math.sigmoid(utility_left - utility_right), dims="task")
+
+    # likelihood via log_sigmoid of the utility difference, as the logp of the
+    # observed choices so predictive sampling and log_likelihood work
+    return paired_logit_dist(
+        "choice_distribution", beta, delta, gamma, *design, f=f, c=c, observed=observed_choice_left,
+        encoding=encoding, theta=theta, z=z, weights=weight, dims="task",
+    )
+
+def basic_choice_model(inputs, likelihood="paired_logit", encoding="index", deduplicate=True,
+                       store_deterministics=False):
+    """
+    Basic choice model: level effects with framing shifts and country
+    effects. deduplicate says whether inputs has collapsed tasks with a
+    weight; store_deterministics keeps the per-task utilities and choice
+    probabilities in the trace.
+    """
+    import pymc as pm
+
+    _check_settings(likelihood, encoding, deduplicate)
+
+    with pm.Model(coords=inputs["coords"]) as model:
+        # main effect of attribute levels
+        beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
+
+        # framing-specific shift for each attribute level
+        delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
+
+        # country effect
+        gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
+
+        # framing (0 or 1), same for all tasks per participant
+        f = pm.Data("f", inputs["f"], dims="task")
+        c = pm.Data("c", inputs["c"], dims="task")
+
+        # observed choices
+        observed_choice_left = pm.Data("observed_choice_left", inputs["observed_choice_left"], dims="task")
+
+        # number of identical tasks each task stands for
+        weight = pm.Data("weight", inputs["weight"], dims="task") if deduplicate else None
+
+        attribute_levels_left, attribute_levels_right, design = _design_data(inputs, encoding)
+
+        _choice_likelihood(
+            likelihood, encoding, store_deterministics, beta, delta, gamma, f, c,
+            attribute_levels_left, attribute_levels_right, design, observed_choice_left, weight,
+        )
+
+    return model
+
+def hybrid_choice_model(inputs, likelihood="paired_logit", encoding="index", deduplicate=True,
+                        store_deterministics=False, likert_sigma=0.1):
+    """
+    Hybrid choice model: the basic model with latent traits per respondent,
+    measured by the Likert indicators (normalized to 0-1, with noise
+    likert_sigma), that moderate the level effects. inputs need the traits.
+    """
+    import pymc as pm
+
+    _check_settings(likelihood, encoding, deduplicate)
+    individual_idx = inputs["individual_idx"]
+
+    with pm.Model(coords=inputs["coords"]) as model:
+        # latent traits per individual, non-centered: standard normal draws
+        # scaled and shifted per trait
+        latent_raw = pm.Normal("latent_raw", mu=0, sigma=1, dims=["individual", "trait"])
+        latent_mu = pm.Normal("latent_mu", mu=0.5, sigma=0.5, dims="trait")
+        latent_sigma = pm.HalfNormal("latent_sigma", sigma=0.5, dims="trait")
+        latent = pm.Deterministic("latent", latent_mu + latent_sigma * latent_raw, dims=["individual", "trait"])
+
+        # observed indicators as continuous (normalized to 0–1), once per
+        # respondent and item, missing answers are left out
+        pm.Normal(
+            "likert_indicators",
+            mu=latent[inputs["indicator_individual"], inputs["indicator_trait"]],
+            sigma=likert_sigma,
+            observed=inputs["indicator_value"],
+        )
+
+        # standardized traits of each task's respondent moderate the coefficients
+        z = latent_raw[individual_idx]
+
+        # framing and country codes are constant per respondent
+        respondent_f = pm.Data("respondent_f", inputs["respondent_f"], dims="individual")
+        respondent_c = pm.Data("respondent_c", inputs["respondent_c"], dims="individual")
+        f = respondent_f[individual_idx].astype("float32")
+        c = respondent_c[individual_idx]
+
+        # number of identical tasks each task stands for
+        weight = pm.Data("weight", inputs["weight"], dims="task") if deduplicate else None
+
+        # observed choices
+        observed_choice_left = pm.Data("observed_choice_left", inputs["observed_choice_left"], dims="task")
+
+        attribute_levels_left, attribute_levels_right, design = _design_data(inputs, encoding)
+
+        # theta coefficients: how much each latent trait moderates the level effects
+        theta = pm.Normal("theta", mu=0, sigma=1, dims=["trait", "level"])
+
+        # choice model: main effects
+        beta = pm.Normal("beta", mu=0, sigma=2, dims="level")
+
+        # framing-specific shift
+        delta = pm.Normal("delta", mu=0, sigma=1, dims="level")
+
+        # country effect
+        gamma = pm.Normal("gamma", mu=0, sigma=1, dims=["country", "level"])
+
+        _choice_likelihood(
+            likelihood, encoding, store_deterministics, beta, delta, gamma, f, c,
+            attribute_levels_left, attribute_levels_right, design, observed_choice_left, weight,
+            theta=theta, z=z,
+        )
+
+    return model
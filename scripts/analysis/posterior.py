@@ -0,0 +1,91 @@
+import numpy as np
+import xarray as xr
+from scipy.special import expit
+
+from scripts.analysis.design import package_products
+
+# Task utilities after sampling
+#
+# The models only store the parameters by default (STORE_DETERMINISTICS).
+# The per-task utility_left, utility_right and probability_choice_left of
+# every draw are computed here from beta, delta, gamma and, for the hybrid
+# model, theta and latent_raw, a chunk of tasks at a time.
+
+def _draws(posterior, name):
+    # (sample x ...) with sample the stacked chain and draw
+    return posterior[name].stack(sample=("chain", "draw")).transpose("sample", ...).values
+
+def package_utilities(posterior, attribute_levels, f, c, encoding, individual_idx=None):
+    """
+    Utility of one package per task for every draw, as (sample x task).
+    attribute_levels are the package's dummies or level indices; the
+    moderation by the latent traits is added if the posterior has theta.
+    """
+    beta = _draws(posterior, "beta")
+    delta = _draws(posterior, "delta")
+    gamma = _draws(posterior, "gamma")
+    n_samples, n_countries, n_levels = gamma.shape
+
+    coefs = [beta, delta, gamma.reshape(-1, n_levels)]
+    moderated = "theta" in posterior
+    if moderated:
+        theta = _draws(posterior, "theta")
+        coefs.append(theta.reshape(-1, n_levels))
+
+    # one product per task and coefficient row of every draw
+    products = package_products(np.vstack(coefs), np.asarray(attribute_levels), encoding)
+    n_tasks = products.shape[0]
+    country = products[:, 2 * n_samples:(2 + n_countries) * n_samples].reshape(n_tasks, n_samples, n_countries)
+
+    utility = (
+        products[:, :n_samples]
+        + np.asarray(f)[:, None] * products[:, n_samples:2 * n_samples]
+        + country[np.arange(n_tasks), :, np.asarray(c)]
+    )
+    if moderated:
+        n_traits = theta.shape[1]
+        z = _draws(posterior, "latent_raw")[:, np.asarray(individual_idx)]
+        moderation = products[:, (2 + n_countries) * n_samples:].reshape(n_tasks, n_samples, n_traits)
+        utility = utility + (moderation * z.transpose(1, 0, 2)).sum(axis=-1)
+    return utility.T
+
+def iter_task_utilities(idata, inputs, encoding="index", chunk_size=250):
+    """
+    utility_left, utility_right and probability_choice_left (chain x draw x
+    task) of the posterior, computed lazily for chunk_size tasks at a time
+    from the model inputs. Yields one Dataset per chunk.
+    """
+    posterior = idata.posterior
+    n_chains, n_draws = posterior.sizes["chain"], posterior.sizes["draw"]
+    if encoding == "index":
+        left, right = inputs["level_index_left"], inputs["level_index_right"]
+    else:
+        left, right = inputs["attribute_levels_left"], inputs["attribute_levels_right"]
+
+    n_tasks = len(inputs["f"])
+    for start in range(0, n_tasks, chunk_size):
+        tasks = slice(start, min(start + chunk_size, n_tasks))
+        individual_idx = inputs["individual_idx"][tasks] if "theta" in posterior else None
+        utilities = {}
+        for name, levels in [("utility_left", left), ("utility_right", right)]:
+            utility = package_utilities(
+                posterior, levels[tasks], inputs["f"][tasks], inputs["c"][tasks], encoding, individual_idx
+            )
+            utilities[name] = utility.reshape(n_chains, n_draws, -1)
+        utilities["probability_choice_left"] = expit(utilities["utility_left"] - utilities["utility_right"])
+
+        yield xr.Dataset(
+            {name: (("chain", "draw", "task"), values) for name, values in utilities.items()},
+            coords={
+                "chain": posterior["chain"],
+                "draw": posterior["draw"],
+                "task": np.arange(tasks.start, tasks.stop),
+            },
+        )
+
+def task_utilities(idata, inputs, encoding="index", chunk_size=250):
+    """
+    All task utilities and choice probabilities of the posterior as one
+    Dataset, see iter_task_utilities.
+    """
+    return xr.concat(list(iter_task_utilities(idata, inputs, encoding, chunk_size)), dim="task")
@@ -0,0 +1,348 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# pymc and arviz are imported where they are used, so importing this module
+# (e.g. for SAMPLER_BACKENDS) stays fast
+
+# NUTS implementations: "pymc" runs pm.sample on the compiled C backend,
+# "numpyro" and "blackjax" compile the model to JAX and sample on the CPU
+SAMPLER_BACKENDS = ["pymc", "numpyro", "blackjax"]
+
+def configure_backend(backend):
+    """
+    Prepare a sampler backend before the model is sampled. The JAX backends
+    are pinned to the CPU and need the JAX version of the likelihood Op;
+    without jax or the sampler package they raise an ImportError.
+
+    tests/test_jax.py checks the JAX likelihood against the numpy Op, and
+    tests/benchmark_backends.py times the backends with compare_backends.
+    """
+    if backend not in SAMPLER_BACKENDS:
+        raise ValueError(f"backend should be one of {SAMPLER_BACKENDS}.")
+
+    if backend != "pymc":
+        for package in ["jax", backend]:
+            if importlib.util.find_spec(package) is None:
+                raise ImportError(f"The {backend} backend needs {package}, which is not installed; use backend='pymc'.")
+
+        # has to be set before jax is first imported
+        os.environ.setdefault("JAX_PLATFORMS", "cpu")
+
+        from scripts.analysis.likelihood import register_jax
+        register_jax()
+
+def sample(model, backend="pymc", draws=1000, tune=500, chains=4, cores=4,
+           random_seed=42, target_accept=0.9, **kwargs):
+    """
+    Sample the model with NUTS from the given backend. The JAX backends run
+    the chains vectorized in a single process, so cores has no effect on
+    them.
+    """
+    import pymc as pm
+
+    configure_backend(backend)
+
+    if backend == "pymc":
+        return pm.sample(
+            model=model,
+            draws=draws,
+            tune=tune,
+            chains=chains,
+            cores=cores,
+            random_seed=random_seed,
+            return_inferencedata=True,
+            target_accept=target_accept,
+            **kwargs,
+        )
+
+    return pm.sample(
+        model=model,
+        draws=draws,
+        tune=tune,
+        chains=chains,
+        cores=cores,
+        random_seed=random_seed,
+        target_accept=target_accept,
+        nuts_sampler=backend,
+        nuts_sampler_kwargs={"chain_method": "vectorized", "postprocessing_backend": "cpu"},
+        **kwargs,
+    )
+
+def compare_backends(model, backends=SAMPLER_BACKENDS, var_names=None, **sample_kwargs):
+    """
+    Sample the model with each backend on the same seed and data, and report
+    wall-clock time and bulk effective samples per second. The ESS is the
+    minimum over the parameters in var_names, so the slowest mixing
+    parameter decides. Returns the table and the inference data per backend.
+    """
+    import arviz as az
+
+    rows = []
+    traces = {}
+
+    for backend in backends:
+        start = time.perf_counter()
+        idata = sample(model, backend=backend, **sample_kwargs)
+        seconds = time.perf_counter() - start
+
+        ess = az.ess(idata, var_names=var_names, method="bulk")
+        min_ess = min(float(ess[var].min()) for var in ess.data_vars)
+        rows.append({
+            "backend": backend,
+            "wall_clock_s": seconds,
+            "min_ess_bulk": min_ess,
+            "ess_per_s": min_ess / seconds,
+        })
+        traces[backend] = idata
+
+    return pd.DataFrame(rows).set_index("backend"), traces
+
+def _align_draws(draws, model, dims):
+    """
+    Draws (chain x draw x ...) with the model's dims, reindexed to the
+    model's coords by label. Dims without labels, like those of the
+    unconstrained parameters, are matched by position.
+    """
+    for original, dim in zip(draws.dims[2:], dims):
+        if original != dim:
+            draws = draws.rename({original: dim})
+            if draws.sizes[dim] == len(model.coords[dim]):
+                draws = draws.assign_coords({dim: list(model.coords[dim])})
+    return draws.reindex({dim: list(model.coords[dim]) for dim in dims})
+
+def _unconstrained_draws(idata, model, value_var):
+    """
+    Draws of a value variable (chain x draw x ...) from a posterior, in the
+    unconstrained space and aligned to the model's coords by label, or None
+    if the posterior does not have the variable. Labels the posterior lacks
+    are NaN.
+    """
+    rv = model.values_to_rvs[value_var]
+    if value_var.name in idata.posterior:
+        draws = idata.posterior[value_var.name]
+    elif rv.name in idata.posterior:
+        draws = idata.posterior[rv.name]
+        transform = model.rvs_to_transforms[rv]
+        if transform is not None:
+            draws = draws.copy(data=transform.forward(draws.values, *rv.owner.inputs).eval())
+    else:
+        return None
+
+    return _align_draws(draws, model, model.named_vars_to_dims.get(rv.name, ()))
+
+def tuning_state(idata, model, chains):
+    """
+    Starting state for sampling the model, taken from a previous posterior
+    (of this or another model): posterior mean and variance of the
+    unconstrained parameters, the final step size, and one start point per
+    chain from the last draws. Parameters or labels missing from the
+    posterior keep the model's initial point and unit variance.
+    """
+    initial_point = model.initial_point()
+    means, variances = [], []
+    for value_var in model.value_vars:
+        mean = np.asarray(initial_point[value_var.name], dtype=float).ravel()
+        variance = np.ones_like(mean)
+        draws = _unconstrained_draws(idata, model, value_var)
+        if draws is not None:
+            draw_mean = draws.mean(["chain", "draw"]).values.ravel()
+            draw_variance = draws.var(["chain", "draw"]).values.ravel()
+            found = ~np.isnan(draw_mean)
+            mean[found] = draw_mean[found]
+            variance[found] = np.maximum(draw_variance[found], 1e-8)
+        means.append(mean)
+        variances.append(variance)
+
+    # start points from the last draws, for parameters with all labels found
+    initvals = [{} for _ in range(chains)]
+    for rv in model.free_RVs:
+        if rv.name not in idata.posterior:
+            continue
+        draws = _align_draws(idata.posterior[rv.name], model, model.named_vars_to_dims.get(rv.name, ()))
+        if draws.isnull().any():
+            continue
+        for chain in range(chains):
+            initvals[chain][rv.name] = draws.isel(chain=chain % draws.sizes["chain"], draw=-1).values
+
+    means = np.concatenate(means)
+    if "sample_stats" in idata.groups():
+        stats = idata.sample_stats
+        step_size = stats["step_size_bar"] if "step_size_bar" in stats else stats["step_size"]
+        step_size = float(step_size.isel(draw=-1).mean())
+    else:
+        # no NUTS run, e.g. an ADVI fit: pymc's default step size
+        step_size = 0.25 / len(means)**0.25
+
+    return means, np.concatenate(variances), step_size, initvals
+
+def _nuts_step(model, mean, variance, step_size, target_accept, adapt, initial_weight=10):
+    """
+    NUTS step with the given mass matrix and step size, which keeps adapting
+    from them if adapt, and stays fixed otherwise.
+    """
+    import pymc as pm
+    from pymc.step_methods.hmc.quadpotential import QuadPotentialDiag, QuadPotentialDiagAdapt
+
+    n = len(mean)
+    if adapt:
+        potential = QuadPotentialDiagAdapt(n, mean, variance, initial_weight)
+    else:
+        potential = QuadPotentialDiag(variance)
+    return pm.NUTS(
+        vars=model.value_vars,
+        potential=potential,
+        step_scale=step_size * n**0.25,
+        target_accept=target_accept,
+        model=model,
+    )
+
+def _block_files(checkpoint_dir):
+    return sorted(glob.glob(os.path.join(checkpoint_dir, "block_*.nc")))
+
+def load_checkpoints(checkpoint_dir, include_transformed=False):
+    """
+    The draws of all finished blocks in a checkpoint directory, concatenated
+    along draw, with the unconstrained parameters only if include_transformed.
+    """
+    import arviz as az
+
+    blocks = [az.from_netcdf(path) for path in _block_files(checkpoint_dir)]
+    if not blocks:
+        raise FileNotFoundError(f"No checkpoints in {checkpoint_dir}.")
+
+    groups = {group: blocks[0][group] for group in blocks[0].groups()}
+    for group in ["posterior", "sample_stats"]:
+        parts = []
+        offset = 0
+        for block in blocks:
+            part = block[group]
+            parts.append(part.assign_coords(draw=part["draw"] + offset))
+            offset += part.sizes["draw"]
+        groups[group] = xr.concat(parts, dim="draw")
+
+    if not include_transformed:
+        groups["posterior"] = groups["posterior"][
+            [var for var in groups["posterior"].data_vars if not var.endswith("__")]
+        ]
+    return az.InferenceData(**groups)
+
+def _array_hash(arrays):
+    digest = hashlib.sha256()
+    for values in arrays:
+        values = np.ascontiguousarray(values)
+        digest.update(f"{values.dtype}{values.shape}".encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()[:16]
+
+def checkpoint_config(model, draws, tune, chains, block_size, random_seed, warm_start=None, inputs_key=None):
+    """
+    Settings and fingerprint of the model a checkpointed run belongs to: the
+    model inputs' bundle key, the free variables and their shapes, the
+    coords, a hash of the data and observed values, and the warm start.
+    Returned in its json form, as stored in config.json.
+    """
+    data = [var.get_value() for var in sorted(model.data_vars, key=lambda var: var.name)]
+    observed = [model.rvs_to_values[rv].data for rv in model.observed_RVs if hasattr(model.rvs_to_values[rv], "data")]
+
+    if warm_start is None or isinstance(warm_start, str):
+        warm_start_key = warm_start
+    else:
+        warm_start_key = _array_hash(warm_start.posterior[name].values for name in sorted(warm_start.posterior.data_vars))
+
+    config = {
+        "draws": draws,
+        "tune": tune,
+        "chains": chains,
+        "block_size": block_size,
+        "random_seed": random_seed,
+        "warm_start": warm_start_key,
+        "inputs": inputs_key,
+        "free_rvs": {name: [int(n) for n in shape] for name, shape in model.eval_rv_shapes().items()},
+        "coords": {name: list(values) for name, values in model.coords.items() if values is not None},
+        "data": _array_hash(data + observed),
+    }
+    return json.loads(json.dumps(config, default=str))
+
+def sample_checkpointed(model, checkpoint_dir, draws=1000, tune=500, chains=4, cores=4,
+                        block_size=100, random_seed=42, target_accept=0.9, warm_start=None, inputs_key=None):
+    """
+    NUTS sampling (pymc backend) in blocks of block_size draws, each written
+    to checkpoint_dir as soon as it is done. Calling it again with the same
+    checkpoint_dir resumes after the last finished block, continuing each
+    chain from its last draw with the tuned step size and mass matrix.
+
+    The first block also runs the tune steps. warm_start, a previous
+    posterior or the path of one (e.g. the basic model's), starts tuning
+    from its step size, mass matrix and last draws, so fewer tune steps do.
+
+    checkpoint_dir keeps the settings and a fingerprint of the model and its
+    data (see checkpoint_config; inputs_key is e.g. inputs["bundle"] of
+    load_model_inputs). A directory of another run raises a ValueError
+    instead of being resumed.
+
+    Returns all draws, as load_checkpoints.
+    """
+    import arviz as az
+    import pymc as pm
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    config_file = os.path.join(checkpoint_dir, "config.json")
+    config = checkpoint_config(model, draws, tune, chains, block_size, random_seed, warm_start, inputs_key)
+    if os.path.exists(config_file):
+        with open(config_file) as f:
+            stored = json.load(f)
+        if stored != config:
+            changed = sorted(key for key in set(stored) | set(config) if stored.get(key) != config.get(key))
+            raise ValueError(
+                f"{checkpoint_dir} holds a run of another model or other settings ({', '.join(changed)} differ), "
+                "use another directory or remove it."
+            )
+    else:
+        with open(config_file, "w") as f:
+            json.dump(config, f)
+
+    n_blocks = -(-draws // block_size)
+    for block in range(len(_block_files(checkpoint_dir)), n_blocks):
+        if block == 0:
+            block_tune = tune
+            step, initvals = None, None
+            if warm_start is not None:
+                if isinstance(warm_start, str):
+                    warm_start = az.from_netcdf(warm_start)
+                mean, variance, step_size, initvals = tuning_state(warm_start, model, chains)
+                step = _nuts_step(model, mean, variance, step_size, target_accept, adapt=True)
+        else:
+            # continue from the finished blocks without further tuning
+            block_tune = 0
+            done = load_checkpoints(checkpoint_dir, include_transformed=True)
+            mean, variance, step_size, initvals = tuning_state(done, model, chains)
+            step = _nuts_step(model, mean, variance, step_size, target_accept, adapt=False)
+
+        idata = pm.sample(
+            model=model,
+            draws=min(block_size, draws - block * block_size),
+            tune=block_tune,
+            step=step,
+            initvals=initvals,
+            chains=chains,
+            cores=cores,
+            random_seed=random_seed + block,
+            idata_kwargs={"include_transformed": True},
+            # a given step already has the target acceptance
+            **({"target_accept": target_accept} if step is None else {}),
+        )
+
+        # write to a temporary file first, so an interrupted write is not reused
+        path = os.path.join(checkpoint_dir, f"block_{block:04d}.nc")
+        idata.to_netcdf(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    return load_checkpoints(checkpoint_dir)
@@ -0,0 +1,207 @@
+import itertools
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.special import expit, softmax
+
+from scripts.parallel import fork_map
+from scripts.preprocessing.schema import CATEGORIES
+
+# Profile simulation
+#
+# Choice probabilities for hypothetical CCS project profiles from the
+# posterior of beta, delta and gamma, by country and framing. A profile is
+# one level per attribute; its utility in a draw is the sum of its levels'
+# coefficients (beta + delta * framing + gamma[country]). Only these three
+# variables are read from the NetCDF file, and probabilities are computed
+# for batches of profiles, in parallel, with all draws of a batch at once.
+# Latent traits of the hybrid model are left at their mean (zero).
+#
+# Framings are given by their codes in the model (0 or 1) and labelled in
+# the results with the model's framing coords, by default the framing
+# levels of preprocessing/schema.py, from which the codes are built.
+
+INTERVAL = 0.95
+
+FRAMINGS = [0, 1]
+
+def attribute_levels(level_names, attributes, baseline_dict=None):
+    """
+    Levels of each attribute from the coefficient names (attr_level).
+    Baselines without a coefficient (drop_first) are added first.
+    """
+    levels = {}
+    for attr in attributes:
+        attr_levels = [name[len(attr) + 1:] for name in level_names if name.startswith(f"{attr}_")]
+        if baseline_dict is not None and baseline_dict[attr] not in attr_levels:
+            attr_levels = [baseline_dict[attr]] + attr_levels
+        levels[attr] = attr_levels
+    return levels
+
+def full_factorial(levels):
+    """
+    Every combination of the attribute levels, one profile per row.
+    """
+    return pd.DataFrame(list(itertools.product(*levels.values())), columns=list(levels))
+
+def profile_index(profiles, level_names, baseline_dict=None):
+    """
+    (profile x attribute) positions of the profiles' levels in the
+    coefficients. Baselines of baseline_dict without a coefficient
+    (drop_first) point to a zero appended to them, as in
+    design.level_index_design; any other unknown level raises a KeyError.
+    """
+    lookup = {name: i for i, name in enumerate(level_names)}
+    n_levels = len(level_names)
+
+    def position(attr, level):
+        if f"{attr}_{level}" in lookup:
+            return lookup[f"{attr}_{level}"]
+        if baseline_dict is not None and level == baseline_dict.get(attr):
+            return n_levels
+        raise KeyError(f"{attr} has no level {level!r} in the coefficients.")
+
+    return np.column_stack([
+        [position(attr, level) for level in profiles[attr]]
+        for attr in profiles.columns
+    ])
+
+def framing_labels(posterior=None):
+    """
+    Labels of the framing codes: the framing coords of an InferenceData
+    that has them, otherwise the framing levels of the choice table schema.
+    """
+    if hasattr(posterior, "groups"):
+        for group in posterior.groups():
+            if "framing" in posterior[group].coords:
+                return list(posterior[group].coords["framing"].values)
+    return list(CATEGORIES["framing"])
+
+def load_coefficients(posterior):
+    """
+    beta, delta (sample x level) and gamma (sample x country x level) of a
+    posterior, given as InferenceData, Dataset or the path of a NetCDF file.
+    From a file only these variables are read. Already loaded coefficients
+    are returned as they are.
+    """
+    if isinstance(posterior, dict):
+        return posterior
+    if isinstance(posterior, str):
+        with xr.open_dataset(posterior, group="posterior") as ds:
+            ds = ds[["beta", "delta", "gamma"]].load()
+    elif hasattr(posterior, "posterior"):
+        ds = posterior.posterior[["beta", "delta", "gamma"]]
+    else:
+        ds = posterior[["beta", "delta", "gamma"]]
+
+    ds = ds.stack(sample=("chain", "draw")).transpose("sample", ...)
+    return {
+        "beta": ds["beta"].values,
+        "delta": ds["delta"].values,
+        "gamma": ds["gamma"].values,
+        "level": list(ds["level"].values),
+        "country": list(ds["country"].values),
+    }
+
+def profile_utilities(coefs, index, framings=FRAMINGS):
+    """
+    Utility of each profile in every draw, as (sample x country x framing x
+    profile).
+    """
+    def extend(values):
+        return np.concatenate([values, np.zeros(values.shape[:-1] + (1,))], axis=-1)
+
+    beta = extend(coefs["beta"])[:, index].sum(axis=-1)
+    delta = extend(coefs["delta"])[:, index].sum(axis=-1)
+    gamma = extend(coefs["gamma"])[:, :, index].sum(axis=-1)
+    framings = np.asarray(framings, dtype=float)
+
+    return (
+        beta[:, None, None, :]
+        + framings[None, None, :, None] * delta[:, None, None, :]
+        + gamma[:, :, None, :]
+    )
+
+def summarize_draws(draws, interval=INTERVAL):
+    """
+    Mean and equal-tailed credible interval over the first (sample) axis.
+    """
+    tail = (1 - interval) / 2
+    lower, upper = np.quantile(draws, [tail, 1 - tail], axis=0)
+    return draws.mean(axis=0), lower, upper
+
+def _simulate_batch(coefs, framings, interval, indices):
+    left_index, right_index = indices
+    probability = expit(
+        profile_utilities(coefs, left_index, framings) - profile_utilities(coefs, right_index, framings)
+    )
+    return summarize_draws(probability, interval)
+
+def _tidy(summaries, coefs, framings, labels, pairs):
+    mean, lower, upper = (np.concatenate(parts, axis=-1) for parts in zip(*summaries))
+    n_countries, n_framings, n_pairs = mean.shape
+    index = pd.MultiIndex.from_product(
+        [coefs["country"], [labels[int(f)] for f in framings], range(n_pairs)], names=["country", "framing", "pair"]
+    )
+    result = pd.DataFrame(
+        {"mean": mean.ravel(), "lower": lower.ravel(), "upper": upper.ravel()}, index=index
+    ).reset_index()
+    return pairs.iloc[result["pair"]].reset_index(drop=True).join(result.drop(columns="pair"))
+
+def simulate_pairs(posterior, left, right, baseline_dict=None, framings=FRAMINGS, labels=None,
+                   interval=INTERVAL, batch_size=500, processes=None):
+    """
+    Probability of choosing the left over the right profile, for every row
+    of the left and right profile tables, by country and framing. Returns
+    one row per pair, country and framing with the posterior mean and the
+    credible interval. Batches of batch_size pairs run in parallel processes.
+    baseline_dict gives the baselines without a coefficient (see
+    profile_index), labels the framing labels (see framing_labels).
+    """
+    if labels is None:
+        labels = framing_labels(posterior)
+    coefs = load_coefficients(posterior)
+    left_index = profile_index(left, coefs["level"], baseline_dict)
+    right_index = profile_index(right, coefs["level"], baseline_dict)
+
+    starts = range(0, len(left), batch_size)
+    batches = [(left_index[s:s + batch_size], right_index[s:s + batch_size]) for s in starts]
+    simulate_batch = partial(_simulate_batch, coefs, framings, interval)
+
+    summaries = fork_map(simulate_batch, batches, processes)
+
+    pairs = left.reset_index(drop=True).add_suffix("_left").join(right.reset_index(drop=True).add_suffix("_right"))
+    return _tidy(summaries, coefs, framings, labels, pairs)
+
+def simulate_profiles(posterior, attributes, baseline_dict, reference=None, **kwargs):
+    """
+    Support for every profile of the full factorial design: the probability
+    of choosing it over the reference profile (a dict of levels, by default
+    all baselines), by country and framing. kwargs go to simulate_pairs.
+    """
+    coefs = load_coefficients(posterior)
+    profiles = full_factorial(attribute_levels(coefs["level"], attributes, baseline_dict))
+    if reference is None:
+        reference = {attr: baseline_dict[attr] for attr in attributes}
+    reference = pd.DataFrame([reference] * len(profiles))[list(attributes)]
+
+    kwargs.setdefault("labels", framing_labels(posterior))
+    result = simulate_pairs(coefs, profiles, reference, baseline_dict, **kwargs)
+    # the reference is the same for all rows
+    result = result.drop(columns=[f"{attr}_right" for attr in attributes])
+    return result.rename(columns={f"{attr}_left": attr for attr in attributes})
+
+def market_shares(posterior, profiles, baseline_dict=None, framings=FRAMINGS, labels=None, interval=INTERVAL):
+    """
+    Shares of a market of competing profiles (one per row), the logit
+    probabilities of each profile being chosen among all of them, by
+    country and framing.
+    """
+    if labels is None:
+        labels = framing_labels(posterior)
+    coefs = load_coefficients(posterior)
+    utilities = profile_utilities(coefs, profile_index(profiles, coefs["level"], baseline_dict), framings)
+    summary = summarize_draws(softmax(utilities, axis=-1), interval)
+    return _tidy([summary], coefs, framings, labels, profiles.reset_index(drop=True))
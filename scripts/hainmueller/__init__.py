@@ -0,0 +1,3 @@
+"""
+Marginal means and AMCEs of the conjoint, in R (cregg) and Python.
+"""
@@ -0,0 +1,94 @@
+import pandas as pd
+from scripts.analysis.marginal_means import load_conjoint, marginal_means, amce, subgroup_sweep, cluster_bootstrap
+from scripts.preprocessing.schema import BASELINES
+
+# %% settings
+
+# the marginal means of source_mms.R, location_mms.R and values_effect.R,
+# computed in-process from the parquet intermediates
+OUTPUT_FILE = "output/marginal_means.csv"
+
+# marginal means of every attribute for all combinations of the moderators
+SWEEP_FILE = "output/subgroup_means.csv"
+
+# marginal means of the R analyses with percentile intervals from a
+# bootstrap over respondents
+BOOTSTRAP_FILE = "output/marginal_means_bootstrap.csv"
+BOOTSTRAP_REPLICATES = 10_000
+
+# baselines of the choice table schema, see preprocessing/schema.py
+baseline_dict = dict(BASELINES)
+
+attributes = list(baseline_dict)
+
+# moderators of the subgroup sweep, at most one per slot is combined; a new
+# moderator is one more entry (a column of the conjoint table)
+sweep = {
+    "value": ["lreco_bin", "galtan_bin", "ecol_bin"],
+    "country": ["country"],
+    "framing": ["framing"],
+    "condition": attributes,
+}
+
+# %% load data
+
+# translated conjoints of all countries with the binned value indices
+df = load_conjoint()
+
+# values_effect.R only keeps respondents with all three bins
+df_values = df.dropna(subset = ["lreco_bin", "galtan_bin", "ecol_bin"])
+
+# %% marginal means
+
+# one entry per cj() call of the R scripts: data, feature and by
+analyses = {
+    "mm_source": (df, "attr_source_purpose", ["country", "framing"]),
+    "mm_source_industry": (df, "attr_source_purpose", ["country", "framing", "attr_industry"]),
+    "mm_source_costs": (df, "attr_source_purpose", ["country", "framing", "attr_costs"]),
+    "mm_location": (df, "attr_vicinity", ["country", "attr_source_purpose", "framing"]),
+    "mm_lreco": (df_values, "attr_industry", ["lreco_bin", "country", "attr_source_purpose"]),
+    "mm_galtan": (df_values, "attr_industry", ["galtan_bin", "country", "attr_source_purpose"]),
+    "mm_ecol": (df_values, "attr_source_purpose", ["ecol_bin", "country", "framing"]),
+    "mm_ecol_industry": (df_values, "attr_industry", ["ecol_bin", "country", "attr_source_purpose"]),
+}
+
+mms = pd.concat(
+    [
+        marginal_means(data, [feature], by = by).assign(analysis = name)
+        for name, (data, feature, by) in analyses.items()
+    ],
+    ignore_index = True
+)
+mms = mms[["analysis"] + [col for col in mms.columns if col != "analysis"]]
+
+mms[mms["analysis"] == "mm_source"]
+
+# %% AMCEs by country
+
+amces = amce(df, attributes, by = ["country"], baselines = baseline_dict)
+amces
+
+# %% subgroup sweep
+
+# all groupings of the sweep in one table, computed in parallel processes
+subgroup_means = subgroup_sweep(df, attributes, sweep)
+subgroup_means[subgroup_means["grouping"] == "lreco_bin+country"]
+
+# %% cluster bootstrap
+
+bootstrap = pd.concat(
+    [
+        cluster_bootstrap(data, [feature], groupings = [by], n_boot = BOOTSTRAP_REPLICATES).assign(analysis = name)
+        for name, (data, feature, by) in analyses.items()
+    ],
+    ignore_index = True
+)
+bootstrap = bootstrap[["analysis"] + [col for col in bootstrap.columns if col != "analysis"]]
+
+# %% save to file
+
+mms.to_csv(OUTPUT_FILE, index = False)
+subgroup_means.to_csv(SWEEP_FILE, index = False)
+bootstrap.to_csv(BOOTSTRAP_FILE, index = False)
+
+# %%
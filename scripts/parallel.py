@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def fork_map(func, jobs, processes=None):
+    """
+    func of every job, in order, in forked processes where available.
+    Processes are forked, so func can be defined in the calling script or
+    notebook and the script is not re-run in the workers. Without fork, or
+    with a single process, the jobs run one after the other.
+    """
+    jobs = list(jobs)
+    if processes is None:
+        processes = min(len(jobs), os.cpu_count() or 1)
+
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [func(job) for job in jobs]
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        return list(executor.map(func, jobs))
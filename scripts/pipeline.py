@@ -0,0 +1,209 @@
+"""
+Run the preprocessing and analysis scripts as stages and skip stages whose
+inputs, code and configuration did not change since their last run.
+
+    python scripts/pipeline.py                 # all preprocessing stages
+    python scripts/pipeline.py fit-basic       # up to the basic choice model
+    python scripts/pipeline.py translate --force
+
+`python -m scripts run` does the same; `python -m scripts <stage>` runs a
+single stage unconditionally.
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from scripts.preprocessing.columns import catalog_table
+from scripts.preprocessing.countries import COUNTRIES, untranslated_table, translated_table, respondent_table
+from scripts.preprocessing.storage import file_hash, table_path
+
+STATE_FILE = "data/.pipeline_state.json"
+
+# hash of a stage whose inputs an earlier stage of a dry run would produce;
+# it never equals a stored hash, so the stage is reported as pending
+NOT_HASHED = object()
+
+PREPROCESSING = "scripts/preprocessing"
+
+# shared modules that every preprocessing stage uses, the registry is configuration
+SHARED_CODE = [
+    f"{PREPROCESSING}/countries.py",
+    f"{PREPROCESSING}/storage.py",
+    "scripts/parallel.py",
+]
+
+# modules the choice model fits use
+FIT_CODE = [
+    f"{PREPROCESSING}/storage.py",
+    f"{PREPROCESSING}/schema.py",
+    "scripts/analysis/likelihood.py",
+    "scripts/analysis/design.py",
+    "scripts/analysis/model_inputs.py",
+    "scripts/analysis/models.py",
+    "scripts/analysis/sampling.py",
+    "scripts/analysis/advi.py",
+    "scripts/analysis/posterior.py",
+]
+
+STAGES = {
+    "ingest": {
+        "script": f"{PREPROCESSING}/prepocessing_basics.py",
+        "code": SHARED_CODE + [f"{PREPROCESSING}/ingest.py", f"{PREPROCESSING}/columns.py"],
+        "deps": [],
+        "inputs": [config["raw_file"] for config in COUNTRIES.values()],
+        "outputs": (
+            [table_path(untranslated_table(code)) for code in COUNTRIES]
+            + [table_path(catalog_table(code)) for code in COUNTRIES]
+        ),
+    },
+    "values": {
+        "script": f"{PREPROCESSING}/value_indices.py",
+        "code": SHARED_CODE + [f"{PREPROCESSING}/scoring.py"],
+        "deps": ["ingest"],
+        "inputs": [table_path(untranslated_table(code)) for code in COUNTRIES],
+        "outputs": [table_path("data_values_ch_cn"), table_path("data_values_ch_cn", fmt="csv")],
+    },
+    "translate": {
+        "script": f"{PREPROCESSING}/translate_conjoints.py",
+        "code": SHARED_CODE + [f"{PREPROCESSING}/mapping.py", f"{PREPROCESSING}/columns.py", f"{PREPROCESSING}/schema.py"],
+        "deps": ["ingest", "values"],
+        "inputs": (
+            [table_path(untranslated_table(code)) for code in COUNTRIES]
+            + [table_path(catalog_table(code)) for code in COUNTRIES]
+            + [table_path("data_values_ch_cn")]
+        ),
+        "outputs": (
+            [table_path(translated_table(code)) for code in COUNTRIES]
+            + [table_path(translated_table(code), fmt="csv") for code in COUNTRIES]
+            + [table_path(respondent_table(code)) for code in COUNTRIES]
+            + [table_path(respondent_table(code), fmt="csv") for code in COUNTRIES]
+            + [table_path("hcm_input")]
+        ),
+    },
+    "fit-basic": {
+        "script": "scripts/analysis/basic_choice_model.py",
+        "code": FIT_CODE + ["scripts/analysis/simulate.py", "scripts/parallel.py"],
+        "deps": ["translate"],
+        "inputs": [table_path("hcm_input")],
+        "outputs": ["output/inference_basic_choice.nc", "output/profile_support_basic.csv"],
+    },
+    "fit-hybrid": {
+        "script": "scripts/analysis/hybrid_choice_model.py",
+        "code": FIT_CODE,
+        "deps": ["translate"],
+        "inputs": [table_path("hcm_input")],
+        "outputs": ["output/inference_hybrid_choice.nc"],
+    },
+    "marginal-means": {
+        "script": "scripts/hainmueller/mms.py",
+        "code": SHARED_CODE + ["scripts/analysis/marginal_means.py", f"{PREPROCESSING}/schema.py"],
+        "deps": ["translate"],
+        "inputs": (
+            [table_path(translated_table(code)) for code in COUNTRIES]
+            + [table_path("data_values_ch_cn")]
+        ),
+        "outputs": [
+            "output/marginal_means.csv",
+            "output/subgroup_means.csv",
+            "output/marginal_means_bootstrap.csv",
+        ],
+    },
+}
+
+# stages run when no target is given
+DEFAULT_TARGETS = ["translate"]
+
+def stage_hash(name, file_hashes):
+    """
+    Hash of everything a stage depends on: its script, the modules and
+    configuration it uses, and its input files.
+    """
+    stage = STAGES[name]
+    paths = [stage["script"]] + stage["code"] + stage["inputs"]
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Input of stage {name} is missing: {path}")
+        digest.update(path.encode())
+        digest.update(file_hash(path, file_hashes).encode())
+    return digest.hexdigest()
+
+def resolve(targets):
+    """
+    Stages needed for the targets, in the order they are defined.
+    """
+    needed = set()
+
+    def visit(name):
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage {name}, choose from {list(STAGES)}.")
+        if name not in needed:
+            needed.add(name)
+            for dep in STAGES[name]["deps"]:
+                visit(dep)
+
+    for target in targets:
+        visit(target)
+    return [name for name in STAGES if name in needed]
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    with open(STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+def run_stage(name):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    subprocess.run([sys.executable, STAGES[name]["script"]], env=env, check=True)
+
+def run(targets=None, force=False, dry_run=False):
+    """
+    Run the stages needed for the targets, skipping stages that are up to date.
+    Stages are hashed right before they run, so a stage whose inputs were
+    rewritten by an earlier stage is detected as changed.
+    """
+    state = load_state()
+    for name in resolve(targets or DEFAULT_TARGETS):
+        stage = STAGES[name]
+        try:
+            current = stage_hash(name, state["files"])
+        except FileNotFoundError:
+            # inputs are only produced by an earlier stage of this run
+            if not dry_run:
+                raise
+            current = NOT_HASHED
+        outputs_exist = all(os.path.exists(path) for path in stage["outputs"])
+
+        if not force and outputs_exist and state["stages"].get(name) == current:
+            print(f"{name}: up to date")
+            continue
+
+        if dry_run:
+            print(f"{name}: would run {stage['script']}")
+            continue
+
+        print(f"{name}: running {stage['script']}")
+
+        run_stage(name)
+        state["stages"][name] = current
+        save_state(state)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", help=f"stages to bring up to date, one of {list(STAGES)}")
+    parser.add_argument("--force", action="store_true", help="rerun the stages even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only print which stages would run")
+    args = parser.parse_args()
+
+    run(args.targets, force=args.force, dry_run=args.dry_run)
@@ -0,0 +1,4 @@
+"""
+Cleaning, scoring and translation of the raw survey exports into the
+parquet intermediates in data/.
+"""
@@ -0,0 +1,131 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Column catalog
+#
+# The columns of a Qualtrics export are parsed once into the task, attribute
+# slot, package and role they hold:
+#
+#   c3_atr2_name           task 3, slot 2, role "name" (the attribute shown)
+#   c3_atr2_p1, c3_atr2_p2 task 3, slot 2, package 1 or 2, role "level"
+#   3_conjoint_choose12    task 3, role "choice"
+#   3_conjoint_plan1       task 3, package 1, role "support"
+#   3_conjoint_timer       other conjoint questions, role "conjoint"
+#   age, lreco_1, ...      everything else, role "meta"
+#
+# Numbers that do not apply are -1. position is the column's index in the
+# table, so the later stages select columns with integer lookups instead of
+# matching the names again. The catalog of each untranslated table is stored
+# next to it.
+
+ROLES = ["name", "level", "choice", "support", "conjoint", "meta"]
+
+# roles of the T_conjoint_* columns, numbered by the export's task numbers
+CONJOINT_ROLES = ["choice", "support", "conjoint"]
+
+ATTRIBUTE_PATTERN = re.compile(r"c(\d+)_atr(\d+)_(name|p1|p2)$")
+CONJOINT_PATTERN = re.compile(r"(\d+)_conjoint_(.*)")
+
+def catalog_table(code):
+    return f"columns_untranslated_{code.lower()}"
+
+def parse_column(col):
+    """
+    Task, slot, package and role of a column name.
+    """
+    match = ATTRIBUTE_PATTERN.match(col)
+    if match:
+        task, slot, kind = match.groups()
+        if kind == "name":
+            return int(task), int(slot), -1, "name"
+        return int(task), int(slot), int(kind[1]), "level"
+
+    match = CONJOINT_PATTERN.match(col)
+    if match:
+        task, question = match.groups()
+        if question == "choose12":
+            return int(task), -1, -1, "choice"
+        if question in ("plan1", "plan2"):
+            return int(task), -1, int(question[-1]), "support"
+        return int(task), -1, -1, "conjoint"
+
+    return -1, -1, -1, "meta"
+
+def build_catalog(columns):
+    """
+    Catalog of a table's columns, one row per column in table order.
+    """
+    parsed = [parse_column(col) for col in columns]
+    return pd.DataFrame({
+        "column": pd.Series(list(columns), dtype=object),
+        "position": np.arange(len(parsed), dtype="int64"),
+        "task": np.array([p[0] for p in parsed], dtype="int64"),
+        "slot": np.array([p[1] for p in parsed], dtype="int64"),
+        "package": np.array([p[2] for p in parsed], dtype="int64"),
+        "role": pd.Series([p[3] for p in parsed], dtype=object),
+    })
+
+def renumber_tasks(catalog, task_offset):
+    """
+    Subtract task_offset from the task numbers of the T_conjoint_* columns,
+    e.g. 6_conjoint_choose12 becomes 1_conjoint_choose12 with an offset of 5.
+    Columns that would get a task number below 1 keep their name. Returns the
+    renamed columns and the new catalog.
+    """
+    catalog = catalog.copy()
+    renumber = catalog["role"].isin(CONJOINT_ROLES).to_numpy() & (catalog["task"].to_numpy() > task_offset)
+
+    renames = {}
+    for row in np.flatnonzero(renumber):
+        col = catalog.at[row, "column"]
+        task = catalog.at[row, "task"] - task_offset
+        renames[col] = f"{task}{col[col.index('_'):]}"
+        catalog.at[row, "column"] = renames[col]
+        catalog.at[row, "task"] = task
+
+    return renames, catalog
+
+def positions(catalog, role, package=None):
+    """
+    Positions of the columns with a role, and optionally a package, in
+    catalog order.
+    """
+    keep = catalog["role"].to_numpy() == role
+    if package is not None:
+        keep &= catalog["package"].to_numpy() == package
+    return catalog["position"].to_numpy()[keep]
+
+def columns_with_role(catalog, roles):
+    """
+    Names of the columns with one of the roles, in table order.
+    """
+    if isinstance(roles, str):
+        roles = [roles]
+    return catalog.loc[catalog["role"].isin(roles), "column"].tolist()
+
+def attribute_slots(catalog):
+    """
+    Positions of the name, package 1 and package 2 level columns of every
+    (task, slot) that has all three, in the order of the name columns.
+    Returns the tasks and a (slots, 3) array of positions.
+    """
+    attributes = catalog[catalog["role"].isin(["name", "level"])]
+    slots = attributes.pivot_table(
+        index=["task", "slot"], columns="package", values="position", aggfunc="first", sort=False
+    )
+    slots = slots.reindex(columns=[-1, 1, 2]).dropna()
+
+    # order of the name columns in the table
+    slots = slots.sort_values(-1, kind="stable").astype("int64")
+    return slots.index.get_level_values("task").to_numpy(), slots.to_numpy()
+
+def task_positions(catalog, tasks, role, package=-1):
+    """
+    Position of the column with a role and package for each task, -1 where
+    the table has no such column.
+    """
+    keep = (catalog["role"].to_numpy() == role) & (catalog["package"].to_numpy() == package)
+    lookup = dict(zip(catalog["task"].to_numpy()[keep], catalog["position"].to_numpy()[keep]))
+    return np.array([lookup.get(task, -1) for task in tasks], dtype="int64")
@@ -0,0 +1,41 @@
+from scripts.parallel import fork_map
+
+# one entry per fielded country, add new countries here
+COUNTRIES = {
+    "CH": {
+        "name": "switzerland",
+        "raw_file": "raw_data/ccs_conjoint_CH_240225_1004.csv",
+        # the CH export numbers the conjoint tasks from 6 onwards
+        "task_offset": 5,
+        # "other countries" is used for both vicinity and source, make vicinity unique
+        "vicinity_fixes": {
+            'anderen Ländern': 'einem anderen Land',
+            'other countries': 'another country'
+        }
+    },
+    "CN": {
+        "name": "china",
+        "raw_file": "raw_data/ccs_conjoint_CN_240225_1752.csv",
+        "task_offset": 0,
+        "vicinity_fixes": {'其他国家': '中国境外'}
+    }
+}
+
+def untranslated_table(code):
+    return f"data_untranslated_{code.lower()}"
+
+def translated_table(code):
+    return f"data_translated_{code.lower()}"
+
+def respondent_table(code):
+    return f"data_respondents_{code.lower()}"
+
+def map_countries(func, codes=None, processes=None):
+    """
+    Run func(code) for every country in the registry, one process per
+    country, and return a dictionary of results in registry order, see
+    parallel.fork_map.
+    """
+    if codes is None:
+        codes = list(COUNTRIES)
+    return dict(zip(codes, fork_map(func, codes, processes)))
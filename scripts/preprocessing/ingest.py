@@ -0,0 +1,135 @@
+import pandas as pd
+from scripts.preprocessing.columns import build_catalog, columns_with_role, renumber_tasks
+from scripts.preprocessing.countries import COUNTRIES
+
+# survey launch time, earlier responses are tests
+LAUNCH_CUTOFF = pd.Timestamp("2025-02-13 10:00:00")
+
+DROP_PREFIXES = ("Recipient", "Location", "Unnamed")
+DROP_COLUMNS = ["IPAddress", "ExternalReference"]
+
+CHUNKSIZE = 10_000
+
+def keep_column(col):
+    """
+    Whether a column of the raw Qualtrics export is kept.
+    """
+    return not col.startswith(DROP_PREFIXES) and col not in DROP_COLUMNS
+
+def export_dtypes(catalog):
+    """
+    Explicit dtypes for the raw export, so that every chunk is parsed the same way.
+    Conjoint columns, as listed in the column catalog, are text, the other
+    columns are left to infer_dtypes.
+    """
+    columns = set(catalog["column"])
+    dtypes = {
+        "DistributionChannel": str,
+        "Q_TerminateFlag": str,
+        "Finished": "boolean",
+    }
+    for col in columns_with_role(catalog, ["name", "level", "choice", "support", "conjoint"]):
+        dtypes[col] = str
+    return {col: dtype for col, dtype in dtypes.items() if col in columns}
+
+def _combined_dtype(kinds, missing):
+    """
+    Dtype of a column over all chunks, from the dtype kinds of the chunks
+    that have values and whether any value is missing.
+    """
+    if kinds == {"i"} and not missing:
+        return "int64"
+    if kinds <= {"i", "f"}:
+        return "float64"
+    if kinds == {"b"} and not missing:
+        return "bool"
+    return str
+
+def infer_dtypes(file_name, columns, chunksize=CHUNKSIZE):
+    """
+    Dtypes of the columns over the whole export, from one pass chunk by
+    chunk. pandas infers the type of each chunk separately, so a column with
+    numbers in early chunks and text later, e.g. postal codes, would mix ints
+    and strings. Columns with text in any chunk are read as text, numbers
+    as int64, or float64 if a value is missing or not whole.
+    """
+    kinds = {col: set() for col in columns}
+    missing = dict.fromkeys(columns, False)
+
+    reader = pd.read_csv(file_name, skiprows=[1, 2], usecols=columns, chunksize=chunksize)
+    for chunk in reader:
+        for col in columns:
+            values = chunk[col]
+            if values.isna().any():
+                missing[col] = True
+            if values.notna().any():
+                kinds[col].add(values.dtype.kind)
+
+    return {col: _combined_dtype(kinds[col], missing[col]) for col in columns}
+
+def filter_responses(df, cutoff=LAUNCH_CUTOFF):
+    """
+    Remove previews, unfinished responses, quota and screened terminations
+    and test responses from before the survey launch.
+    """
+    finished = df["Finished"].ne(False).fillna(True).astype(bool)
+    keep = (
+        (df["DistributionChannel"] != "preview")
+        & finished
+        & (df["Q_TerminateFlag"] != "QuotaMet")
+        & (df["Q_TerminateFlag"] != "Screened")
+        & (df["StartDate"] >= cutoff)
+    )
+    return df[keep]
+
+def read_export(file_name, chunksize=CHUNKSIZE, cutoff=LAUNCH_CUTOFF):
+    """
+    Read a raw Qualtrics export chunk by chunk, skipping the two label rows
+    below the header. Unused columns are never loaded and every chunk is
+    filtered before the next one is read, so memory use is bounded by the
+    cleaned data plus one chunk. The dtypes are fixed before the read, see
+    infer_dtypes, so the chunk size does not change the result.
+    """
+    header = pd.read_csv(file_name, nrows=0).columns
+    columns = [col for col in header if keep_column(col)]
+
+    dtypes = export_dtypes(build_catalog(columns))
+    inferred = [col for col in columns if col not in dtypes and col != "StartDate"]
+    dtypes.update(infer_dtypes(file_name, inferred, chunksize))
+
+    reader = pd.read_csv(
+        file_name,
+        skiprows=[1, 2],
+        usecols=columns,
+        dtype=dtypes,
+        parse_dates=["StartDate"],
+        chunksize=chunksize
+    )
+
+    chunks = []
+    for chunk in reader:
+        chunk = filter_responses(chunk, cutoff)
+        if "education_year" in chunk.columns:
+            chunk["education_year"] = pd.to_numeric(chunk["education_year"], errors="coerce")
+        chunks.append(chunk)
+
+    # keep the column order of the export
+    return pd.concat(chunks, ignore_index=True)[columns]
+
+def fix_conjoint_column_names(df, task_offset=5):
+    """
+    Renumber the conjoint task columns, e.g. 6_conjoint_choose12 becomes
+    1_conjoint_choose12 with an offset of 5.
+    """
+    new_columns, _ = renumber_tasks(build_catalog(df.columns), task_offset)
+    return df.rename(columns=new_columns)
+
+def ingest_country(code):
+    """
+    Read and clean the raw export of one country from the registry.
+    """
+    config = COUNTRIES[code]
+    df = read_export(config["raw_file"])
+    if config["task_offset"]:
+        df = fix_conjoint_column_names(df, config["task_offset"])
+    return df
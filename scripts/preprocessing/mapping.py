@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+def apply_mapping(df, mapping_dict, column_pattern=None, report_unmapped=False, as_categorical=False, columns=None):
+    """
+    Apply a mapping to columns in the DataFrame based on a dictionary, with
+    an optional string or list of strings column_pattern to filter column names.
+    If None, all columns are considered. columns instead names the columns
+    exactly, e.g. from the column catalog, so no names are scanned.
+
+    mapping_dict can also be a list of dictionaries, which are applied one
+    after the other in a single pass. The mapping is done on the distinct
+    levels of each column rather than on every cell. With report_unmapped,
+    levels that are not a key of any dictionary are printed as a warning.
+    With as_categorical, the mapped columns are returned as categoricals.
+    """
+    
+    # turn mapping_dict into a list if it already isn't
+    if isinstance(mapping_dict, dict):
+        mapping_dicts = [mapping_dict]
+    elif isinstance(mapping_dict, list) and all(isinstance(d, dict) for d in mapping_dict):
+        mapping_dicts = mapping_dict
+    else:
+        raise ValueError("mapping_dict should be a dictionary or list of dictionaries.")
+
+     # turn column_pattern into a list it already isn't
+    if isinstance(column_pattern, str):
+        column_patterns = [column_pattern]
+    elif isinstance(column_pattern, list) and all(isinstance(pat, str) for pat in column_pattern):
+        column_patterns = column_pattern
+    elif column_pattern is None:
+        column_patterns = []
+    else:
+        raise ValueError("column_pattern should be a string, list of strings, or None.")
+    
+    # identify columns to apply the mapping
+    if columns is not None:
+        if column_patterns:
+            raise ValueError("Give either column_pattern or columns, not both.")
+        columns_to_map = list(columns)
+    elif column_patterns:
+        columns_to_map = [col for col in df.columns if any(pat in col for pat in column_patterns)]
+    else:
+        columns_to_map = df.columns
+    
+    # apply mapping to the identified columns
+    for column in columns_to_map:
+        df[column] = _map_column(df[column], mapping_dicts, report_unmapped, as_categorical)
+    
+    return df
+
+def _map_column(series, mapping_dicts, report_unmapped=False, as_categorical=False):
+    """
+    Map the distinct levels of a column through a list of dictionaries and
+    rebuild the column from the level codes.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        levels = series.cat.categories
+    else:
+        codes, levels = pd.factorize(series)
+
+    mapped_levels = []
+    unmapped = []
+    for level in levels:
+        if report_unmapped and not any(level in d for d in mapping_dicts):
+            unmapped.append(level)
+        for d in mapping_dicts:
+            level = d.get(level, level)
+        mapped_levels.append(level)
+
+    if unmapped:
+        print(f"Warning: unmapped levels in column {series.name}: {unmapped}")
+
+    # several levels can map to the same value, so the categories are rebuilt
+    level_codes, categories = pd.factorize(pd.Series(mapped_levels, dtype=object))
+    known = codes >= 0
+    new_codes = np.full_like(codes, -1)
+    new_codes[known] = level_codes[codes[known]]
+
+    if as_categorical:
+        return pd.Series(
+            pd.Categorical.from_codes(new_codes, categories),
+            index=series.index,
+            name=series.name
+        )
+
+    values = np.full(len(new_codes), np.nan, dtype=object)
+    values[known] = np.asarray(categories, dtype=object)[new_codes[known]]
+    return pd.Series(values, index=series.index, name=series.name)
@@ -1,94 +1,36 @@
-import pandas as pd
-import re
+from scripts.preprocessing.columns import build_catalog, catalog_table
+from scripts.preprocessing.countries import map_countries, untranslated_table
+from scripts.preprocessing.ingest import ingest_country
+from scripts.preprocessing.storage import write_table
 
 
-# %% import data
-
-pd.set_option('display.max_columns', None)
-
-files = {
-    "CH": "raw_data/ccs_conjoint_CH_240225_1004.csv",
-    "CN": "raw_data/ccs_conjoint_CN_240225_1752.csv"
-}
-
-dataframes = {}
-
-for country, file_name in files.items():
-    # read the file, skipping the first two rows
-    df = pd.read_csv(file_name, skiprows=[1, 2])
-    df["StartDate"] = pd.to_datetime(df["StartDate"])
-    
-    # store the processed dataframe in the dictionary
-    dataframes[country] = df
-
-# %% filter data
-
-# survey launch time
-cutoff = pd.Timestamp("2025-02-13 10:00:00")
-
-for country, df in dataframes.items():
-    # filter out rows where DistributionChannel is 'preview' or screened_out is True
-    df = df[(df['DistributionChannel'] != 'preview') & (df['Finished'] != False)]
-    df = df[(df['Q_TerminateFlag'] != "QuotaMet")]
-    df = df[(df['Q_TerminateFlag'] != "Screened")]
-
-    # filter out testing IDs using the cutoff time of official launch
-    df = df[df["StartDate"] >= cutoff]
-    
-    # update the dataframe in the dictionary
-    dataframes[country] = df
-
-# %% fix typos and datatypes, delete empty columns
-
-for country, df in dataframes.items():
-    cols_to_drop = [
-        col for col in df.columns
-        if col.startswith("Recipient")
-        or col.startswith("Location")
-        or col.startswith("Unnamed")
-        or col == "IPAddress"
-        or col == "ExternalReference"
-    ]
-    dataframes[country] = df.drop(columns=cols_to_drop)
-
-    if "education_year" in df.columns:
-        df["education_year"] = pd.to_numeric(df["education_year"], errors="coerce")
-
-    dataframes[country] = df
-
-def fix_conjoint_column_names(df):
-    new_columns = {}
-
-    for col in df.columns:
-        match = re.match(r"^(\d+)(_conjoint_.*)", col)
-        if match:
-            old_task_num, rest = match.groups()
-            new_task_num = int(old_task_num) - 5
-            if new_task_num > 0:
-                new_col_name = f"{new_task_num}{rest}"
-                new_columns[col] = new_col_name
-
-    return df.rename(columns=new_columns)
-
-dataframes["CH"] = fix_conjoint_column_names(dataframes["CH"])
-
 # %% add response IDs and other columns
 
-total_rows = sum(len(df) for df in dataframes.values())
-id_counter = 1
+def assign_ids(dataframes):
+    """
+    Number the respondents of all countries consecutively, in registry order.
+    """
+    id_counter = 1
+
+    for country, df in dataframes.items():
+        df['id'] = range(id_counter, id_counter + len(df))
+        id_counter += len(df)
+        dataframes[country] = df
 
-for country, df in dataframes.items():
-    df['id'] = range(id_counter, id_counter + len(df))
-    id_counter += len(df)
-    dataframes[country] = df
+    return dataframes
 
-ch_df = dataframes["CH"]
-cn_df = dataframes["CN"]
+# %% import data and save clean data
 
-# %% save clean data
+def main():
+    # read, filter, drop unused columns and fix column names, one process per country
+    dataframes = assign_ids(map_countries(ingest_country))
 
-cn_df.to_csv("data/data_untranslated_cn.csv")
-ch_df.to_csv("data/data_untranslated_ch.csv")
+    # each table is stored with the catalog of its columns, see columns.py
+    for country, df in dataframes.items():
+        write_table(df, untranslated_table(country))
+        write_table(build_catalog(df.columns), catalog_table(country))
 
+if __name__ == "__main__":
+    main()
 
 # %%
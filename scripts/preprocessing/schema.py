@@ -0,0 +1,67 @@
+import pandas as pd
+
+# Long choice table schema
+#
+# The translated long tables have one row per respondent, task and package.
+# choice_table gives their columns compact types: small integers for the
+# task and package numbers and the choice, a nullable integer for the
+# support, and categoricals with fixed level orders for the plan chosen,
+# the framing and the attributes. The attribute levels are listed with the
+# baseline first, so the category codes can be used as level indices
+# directly, see analysis/design.py. BASELINES is the baseline_dict of mms.py
+# and the model scripts.
+
+ATTRIBUTE_LEVELS = {
+    "attr_engagement": ["inform", "consult", "vote"],
+    "attr_vicinity": ["abroad", "another region", "your region", "your municipality"],
+    "attr_industry": ["waste incineration", "metal and cement production", "gas with CCS"],
+    "attr_costs": ["taxpayer", "polluting industry"],
+    "attr_reason": ["sparsely-populated", "close to source", "cost-efficient"],
+    "attr_source_purpose": ["domestic", "foreign"],
+}
+
+BASELINES = {attr: levels[0] for attr, levels in ATTRIBUTE_LEVELS.items()}
+
+CATEGORIES = {
+    "chosen_plan": ["Plan 1", "Plan 2"],
+    "framing": ["purpose", "source"],
+    **ATTRIBUTE_LEVELS,
+}
+
+INTEGERS = {
+    "task": "int8",
+    "package": "int8",
+    "chosen": "int8",
+    "supported": "Int8",
+}
+
+def memory_footprint(df):
+    """
+    Memory used by a table in MB, counting the strings of object columns.
+    """
+    return df.memory_usage(deep=True).sum() / 1e6
+
+def choice_table(df, categories=CATEGORIES, report=False):
+    """
+    Copy of a long choice table with the schema enforced. Levels that are
+    not listed in categories raise a ValueError instead of becoming missing.
+    With report, the memory footprint before and after is printed.
+    """
+    table = df.copy()
+
+    for col, dtype in INTEGERS.items():
+        if col in table.columns:
+            table[col] = pd.to_numeric(table[col]).astype(dtype)
+
+    for col, levels in categories.items():
+        if col not in table.columns:
+            continue
+        values = pd.Categorical(table[col], categories=levels)
+        unknown = table[col].notna().to_numpy() & (values.codes < 0)
+        if unknown.any():
+            raise ValueError(f"Unknown levels in column {col}: {list(pd.unique(table[col][unknown]))}")
+        table[col] = values
+
+    if report:
+        print(f"choice table: {memory_footprint(df):.2f} MB -> {memory_footprint(table):.2f} MB")
+    return table
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+likert_values_value_ques = [
+    'Completely disagree',
+    'Somewhat disagree',
+    'Disagree',
+    'Somewhat agree',
+    'Agree',
+    'Completely agree'
+]
+
+likert_values_five = [
+    "Not at all worried",
+    "Not very worried",
+    "Somewhat worried",
+    "Very worried",
+    "Extremely worried"
+]
+
+net_zero_translation = {
+    "Absolutely sufficient":"Completely agree",
+    "Sufficient":"Agree",
+    "Slightly sufficient":"Somewhat agree",
+    "Slightly insufficient":"Somewhat disagree",
+    "Insufficient":"Disagree",
+    "Absolutely insufficient":"Completely disagree"
+}
+
+numerical_values_normalised = [0, 0.2, 0.4, 0.6, 0.8, 1]
+numerical_values_reversed =  [1, 0.8, 0.6, 0.4, 0.2, 0]
+numerical_values_five = [1, 0.75, 0.5, 0.25, 0]
+
+# answer levels and their scores, answers not listed here
+# ("Not sure", "Prefer not to say") are scored as missing
+SCALES = {
+    "normalised": (likert_values_value_ques, numerical_values_normalised),
+    "reversed": (likert_values_value_ques, numerical_values_reversed),
+    "five_point_reversed": (likert_values_five, numerical_values_five),
+    # the net zero answers are scored like their agree/disagree counterparts
+    "net_zero_reversed": (
+        list(net_zero_translation),
+        [dict(zip(likert_values_value_ques, numerical_values_reversed))[level]
+         for level in net_zero_translation.values()]
+    ),
+}
+
+# scale of each item
+ITEMS = {
+    "lreco_1": "reversed",
+    "lreco_2": "normalised",
+    "lreco_3": "normalised",
+    "galtan_1": "reversed",
+    "galtan_2": "reversed",
+    "net_zero_question": "net_zero_reversed",
+    "socio_ecological_1": "reversed",
+    "socio_ecological_2": "normalised",
+    "climate_worried": "five_point_reversed",
+}
+
+# items summed into each index
+INDICES = {
+    "lreco": ["lreco_1", "lreco_2", "lreco_3"],
+    "galtan": ["galtan_1", "galtan_2", "net_zero_question"],
+    "socio_ecol": ["socio_ecological_1", "socio_ecological_2", "climate_worried"],
+}
+
+def score_item(series, scale):
+    """
+    Score the answers to one item with a single categorical lookup.
+    """
+    levels, scores = SCALES[scale]
+    codes = pd.Categorical(series, categories=levels).codes
+    # code -1 (unknown answer) picks the trailing NaN
+    lookup = np.append(np.asarray(scores, dtype=np.float32), np.float32(np.nan))
+    return lookup[codes]
+
+def score_items(df, items=ITEMS):
+    """
+    Scores of all items present in df as a float32 DataFrame.
+    """
+    scored = {
+        item: score_item(df[item], scale)
+        for item, scale in items.items() if item in df.columns
+    }
+    return pd.DataFrame(scored, index=df.index)
+
+def compute_indices(scores, indices=INDICES):
+    """
+    Sum the item scores of each index in one matrix operation. An index is
+    missing if any of its items is missing, and is only computed if all its
+    items are present in scores.
+    """
+    indices = {name: items for name, items in indices.items() if set(items).issubset(scores.columns)}
+    if not indices:
+        return pd.DataFrame(index=scores.index)
+
+    columns = [item for items in indices.values() for item in items]
+    starts = np.cumsum([0] + [len(items) for items in indices.values()])[:-1]
+    sums = np.add.reduceat(scores[columns].to_numpy(dtype=np.float32), starts, axis=1)
+    return pd.DataFrame(sums, index=scores.index, columns=list(indices))
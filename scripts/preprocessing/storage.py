@@ -0,0 +1,112 @@
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+DATA_DIR = "data"
+
+# intermediates are stored as parquet, csv is kept for the R scripts
+STORAGE_FORMAT = "parquet"
+
+EXTENSIONS = {
+    "parquet": ".parquet",
+    "csv": ".csv"
+}
+
+def table_path(name, fmt=STORAGE_FORMAT, data_dir=DATA_DIR):
+    """
+    Path of a stored table, e.g. data/data_untranslated_ch.parquet
+    """
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"fmt should be one of {list(EXTENSIONS)}.")
+    return os.path.join(data_dir, name + EXTENSIONS[fmt])
+
+def is_attribute_column(col):
+    """
+    Columns holding attribute names or levels, in wide or long format.
+    """
+    return col.startswith("attr_") or re.match(r"c\d+_atr\d+_(name|p1|p2)$", col) is not None
+
+def to_storage_types(df):
+    """
+    Give columns compact types before writing: categoricals for attribute
+    names and levels, integers for ids, task and package numbers.
+    Integer columns, e.g. the int8 columns of schema.choice_table, datetimes
+    and other columns are kept as they are.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if is_attribute_column(col) or col == "framing":
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+        elif col in ["id", "task", "package"] and not pd.api.types.is_integer_dtype(df[col]):
+            values = pd.to_numeric(df[col])
+            if values.notna().all():
+                df[col] = values.astype("int64")
+    return df
+
+def write_table(df, name, fmt=STORAGE_FORMAT, data_dir=DATA_DIR):
+    """
+    Write a pipeline intermediate. Parquet keeps the column types, so no
+    parsing is needed when the next stage reads it back.
+    """
+    path = table_path(name, fmt, data_dir)
+    if fmt == "parquet":
+        to_storage_types(df).to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+def read_table(name, columns=None, fmt=STORAGE_FORMAT, data_dir=DATA_DIR):
+    """
+    Read a pipeline intermediate. If columns is given, only those columns are
+    loaded; columns missing from the table are skipped.
+    """
+    path = table_path(name, fmt, data_dir)
+    if fmt == "parquet":
+        if columns is not None:
+            import pyarrow.parquet as pq
+            available = set(pq.read_schema(path).names)
+            columns = [col for col in columns if col in available]
+        return pd.read_parquet(path, columns=columns)
+    if columns is not None:
+        wanted = set(columns)
+        return pd.read_csv(path, usecols=lambda col: col in wanted)
+    return pd.read_csv(path)
+
+def join_respondents(df, respondents, columns=None):
+    """
+    Wide view of a long table: the respondent columns (all, or those in
+    columns) joined onto every row by id.
+    """
+    if columns is not None:
+        respondents = respondents[["id"] + [col for col in columns if col != "id"]]
+    return df.merge(respondents, on="id", how="left", validate="many_to_one")
+
+def export_csv(df, name, data_dir=DATA_DIR):
+    """
+    Export a table as csv, e.g. for the cregg scripts in scripts/hainmueller.
+    """
+    return write_table(df, name, fmt="csv", data_dir=data_dir)
+
+def file_hash(path, cache=None):
+    """
+    Content hash of a file. Hashes are cached by size and modification time,
+    so large files that did not change are not read again.
+    """
+    if cache is None:
+        cache = {}
+    stat = os.stat(path)
+    key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = cache.get(path)
+    if cached and cached["key"] == key:
+        return cached["hash"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    cache[path] = {"key": key, "hash": digest.hexdigest()}
+    return cache[path]["hash"]
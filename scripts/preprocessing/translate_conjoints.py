@@ -1,42 +1,14 @@
 import pandas as pd
+import numpy as np
 import re
+from scripts.preprocessing.columns import attribute_slots, build_catalog, catalog_table, columns_with_role, task_positions
+from scripts.preprocessing.mapping import apply_mapping
+from scripts.preprocessing.schema import choice_table
+from scripts.preprocessing.countries import COUNTRIES, map_countries, untranslated_table, translated_table, respondent_table
+from scripts.preprocessing.storage import read_table, write_table, export_csv, join_respondents
 
 # %% 
-
-ch_df = pd.read_csv("data/data_untranslated_ch.csv")
-cn_df = pd.read_csv("data/data_untranslated_cn.csv")
-
-# %% 
-def apply_mapping(df, mapping_dict, column_pattern=None):
-    """
-    Apply a mapping to columns in the DataFrame based on a dictionary, with
-    an optional string or list of strings column_pattern to filter column names.
-    If None, all columns are considered.
-    """
-    
-     # turn column_pattern into a list it already isn't
-    if isinstance(column_pattern, str):
-        column_patterns = [column_pattern]
-    elif isinstance(column_pattern, list) and all(isinstance(pat, str) for pat in column_pattern):
-        column_patterns = column_pattern
-    elif column_pattern is None:
-        column_patterns = []
-    else:
-        raise ValueError("column_pattern should be a string, list of strings, or None.")
-    
-    # identify columns to apply the mapping
-    if column_patterns:
-        columns_to_map = [col for col in df.columns if any(pat in col for pat in column_patterns)]
-    else:
-        columns_to_map = df.columns
-    
-    # apply mapping to the identified columns
-    for column in columns_to_map:
-        df[column] = df[column].replace(mapping_dict)
-    
-    return df
-
-def reshape_conjoint_to_long(df, respondent_id_col = None, country = "CH"):
+def reshape_conjoint_to_long(df, respondent_id_col = None, country = "CH", method = "columnar", catalog = None):
     """
     Reshape randomized conjoint data into long format with
     one row per respondent, per task, per package (p1/p2)
@@ -45,7 +17,16 @@ def reshape_conjoint_to_long(df, respondent_id_col = None, country = "CH"):
     Parameters:
     df : pd.DataFrame wide-format dataframe
     respondent_id_col : str or None for respondent identifiers
+    method : "columnar" stacks all attribute columns at once,
+        "loop" is the original row-by-row implementation
+    catalog : column catalog of df (see columns.py) for the columnar
+        method, built from the column names if None
     """
+    if method == "columnar":
+        return _reshape_conjoint_to_long_columnar(df, respondent_id_col, catalog)
+    elif method != "loop":
+        raise ValueError("method should be 'columnar' or 'loop'.")
+
     n_rows = df.shape[0]
     name_cols = [col for col in df.columns if re.match(r"c\d+_atr\d+_name", col)]
     long_data = []
@@ -133,6 +114,119 @@ def reshape_conjoint_to_long(df, respondent_id_col = None, country = "CH"):
 
     return long_df
 
+def _support_to_int(series):
+    """
+    Code "In favor" as 1 and any other answer as 0, keeping missing values.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    return (series == "In favor").astype(float).where(series.notna())
+
+def _reshape_conjoint_to_long_columnar(df, respondent_id_col = None, catalog = None):
+    """
+    Columnar version of reshape_conjoint_to_long. The attribute name and level
+    columns of all tasks are stacked into one array instead of looping over
+    respondents, so the work per respondent is done by numpy and pandas.
+    Columns are selected by their positions in the column catalog.
+    """
+    if catalog is None:
+        catalog = build_catalog(df.columns)
+
+    # name, package 1 and package 2 level column of each task and slot
+    tasks, slots = attribute_slots(catalog)
+
+    if not len(tasks):
+        print("Warning: No rows created. Check for missing attribute columns.")
+        return pd.DataFrame()
+
+    n_rows = df.shape[0]
+
+    # stack task by task, in the same order as the loop version
+    def stack(positions):
+        return df.iloc[:, positions].to_numpy(dtype=object).ravel(order="F")
+
+    attr = stack(slots[:, 0])
+    level_p1 = stack(slots[:, 1])
+    level_p2 = stack(slots[:, 2])
+
+    # choice and support only vary by task, so they are looked up once per task
+    unique_tasks = np.unique(tasks)
+    task_pos = np.repeat(np.searchsorted(unique_tasks, tasks), n_rows)
+    row_pos = np.tile(np.arange(n_rows), len(tasks))
+
+    def per_task(role, package=-1, transform=None):
+        columns = [
+            df.iloc[:, pos] if pos >= 0 else pd.Series(np.nan, index=df.index)
+            for pos in task_positions(catalog, unique_tasks, role, package)
+        ]
+        if transform is not None:
+            columns = [transform(col) for col in columns]
+        return np.column_stack([col.to_numpy(dtype=object) for col in columns])[row_pos, task_pos]
+
+    chosen_plan = per_task("choice")
+    plan1_support = per_task("support", 1, _support_to_int)
+    plan2_support = per_task("support", 2, _support_to_int)
+
+    keep = pd.notna(attr)
+    base = pd.DataFrame({
+        "task": np.repeat(tasks, n_rows)[keep],
+        "chosen_plan": pd.Series(list(chosen_plan[keep])),
+        "attr": attr[keep],
+    })
+    if respondent_id_col:
+        base.insert(0, "id", df[respondent_id_col].to_numpy()[row_pos[keep]])
+
+    # duplicate the rows for package 1 and 2
+    long_df = pd.concat([
+        base.assign(
+            package="1",
+            level=level_p1[keep],
+            chosen=(base["chosen_plan"] == "Plan 1").astype(int),
+            supported=plan1_support[keep]
+        ),
+        base.assign(
+            package="2",
+            level=level_p2[keep],
+            chosen=(base["chosen_plan"] == "Plan 2").astype(int),
+            supported=plan2_support[keep]
+        ),
+    ], ignore_index=True)
+
+    index_cols = ["task", "package"]
+    if respondent_id_col:
+        index_cols.insert(0, "id")
+
+    # one column per attribute, keeping the order in which attributes appear
+    attr_order = pd.unique(attr[keep])
+    levels = (
+        long_df
+        .groupby(index_cols + ["attr"], sort=False)["level"]
+        .first()
+        .unstack("attr")
+        .reindex(columns=attr_order)
+    )
+    levels.columns = [f"attr_{name}" for name in levels.columns]
+
+    other = long_df.groupby(index_cols)[["chosen_plan", "chosen", "supported"]].first()
+    long_df = other.join(levels).reset_index()
+    long_df["supported"] = pd.to_numeric(long_df["supported"])
+
+    if "attr_source" in long_df.columns or "attr_purpose" in long_df.columns:
+        source = long_df.get("attr_source", pd.Series(np.nan, index=long_df.index))
+        purpose = long_df.get("attr_purpose", pd.Series(np.nan, index=long_df.index))
+        long_df["attr_source_purpose"] = source.combine_first(purpose)
+        long_df["framing"] = None
+        long_df.loc[source.notna(), "framing"] = "source"
+        long_df.loc[purpose.notna(), "framing"] = "purpose"
+
+        long_df = long_df.drop(columns=["attr_source", "attr_purpose"], errors="ignore")
+
+    attr_cols = [col for col in long_df.columns if col.startswith("attr_")]
+    other_cols = [col for col in long_df.columns if not col.startswith("attr_")]
+    long_df = long_df[other_cols + attr_cols]
+
+    return long_df
+
 # %% translate attribute names
 
 attr_names_dict = {
@@ -172,45 +266,6 @@ attr_names_dict = {
     "在储存项目的决策中，您将": "engagement"
 }
 
-ch_df = apply_mapping(ch_df, attr_names_dict, column_pattern='name')
-cn_df = apply_mapping(cn_df, attr_names_dict, column_pattern='name')
-
-
-# %% restructure data
-
-dfs = [ch_df, cn_df]
-long_dfs = []
-
-for df in dfs:
-    df_long = reshape_conjoint_to_long(df, respondent_id_col="id")
-    
-    used_cols = [col for col in df.columns if re.match(r"c\d+_atr\d+_(name|p1|p2)", col)]
-    conjoint_cols = [col for col in df.columns if "_conjoint_" in col]
-    meta_cols = [col for col in df.columns if col not in used_cols + conjoint_cols]
-    
-    cols_to_keep = meta_cols
-    if "id" not in cols_to_keep:
-        cols_to_keep.append("id")
-    
-    df_meta = df[cols_to_keep].drop_duplicates()
-    
-    df_long = df_long.merge(df_meta, on="id", how="left")
-    long_dfs.append(df_long)
-
-
-# %% replace repeated value before translation
-
-ch_long = long_dfs[0]
-cn_long = long_dfs[1]
-
-cn_long['attr_vicinity'] = cn_long['attr_vicinity'].replace({'其他国家': '中国境外'})
-ch_long['attr_vicinity'] = ch_long['attr_vicinity'].replace({
-    'anderen Ländern': 'einem anderen Land',
-    'other countries': 'another country'
-})
-
-
-
 # %% translate attribute levels
 
 attr_levels_dict = {
@@ -317,17 +372,67 @@ attr_levels_dict = {
     "仅接收有关项目影响的信息，但不能积极参与决策": "inform"
 }
 
-ch_long = apply_mapping(ch_long, attr_levels_dict, column_pattern='attr')
-cn_long = apply_mapping(cn_long, attr_levels_dict, column_pattern='attr')
+# %% translate and restructure data per country
+
+def translate_country(code):
+    """
+    Translate the attribute names, reshape to long format and translate the
+    attribute levels of one country's data, typed by schema.choice_table.
+    The long choice table and the respondent table with the metadata, one
+    row per id, are saved as parquet and as csv for the cregg scripts;
+    read_conjoint joins them.
+    """
+    df = read_table(untranslated_table(code))
+    catalog = read_table(catalog_table(code))
+    if catalog["column"].tolist() != df.columns.tolist():
+        raise ValueError(f"The column catalog of {untranslated_table(code)} is out of date, rerun the ingest stage.")
+
+    df = apply_mapping(df, attr_names_dict, columns=columns_with_role(catalog, "name"))
 
-# %% save to file
+    # restructure data
+    df_long = reshape_conjoint_to_long(df, respondent_id_col="id", catalog=catalog)
 
-ch_long.to_csv("data/data_translated_ch.csv", index = False)
-cn_long.to_csv("data/data_translated_cn.csv", index = False)
+    # the metadata is stored once per respondent instead of on every profile
+    cols_to_keep = ["id"] + [col for col in columns_with_role(catalog, "meta") if col != "id"]
+    if df["id"].duplicated().any():
+        raise ValueError(f"The respondent ids of {untranslated_table(code)} are not unique.")
 
-# %% make data file for HCM
+    df_respondents = df[cols_to_keep]
+
+    # replace repeated vicinity value and translate in one pass
+    vicinity_fixes = COUNTRIES[code]["vicinity_fixes"]
+    df_long = apply_mapping(df_long, [vicinity_fixes, attr_levels_dict], columns=['attr_vicinity'])
+
+    other_attr_cols = [col for col in df_long.columns if col.startswith('attr_') and col != 'attr_vicinity']
+    df_long = apply_mapping(df_long, attr_levels_dict, columns=other_attr_cols, report_unmapped=True)
 
-values = pd.read_csv("data/data_values_ch_cn.csv")
+    # compact types with the fixed level orders of schema.py
+    df_long = choice_table(df_long, report=True)
+
+    # save to file
+    write_table(df_long, translated_table(code))
+    export_csv(df_long, translated_table(code))
+    write_table(df_respondents, respondent_table(code))
+    export_csv(df_respondents, respondent_table(code))
+
+    return translated_table(code)
+
+def read_conjoint(code, columns=None):
+    """
+    Wide view of one country's translated conjoint: the long choice table with
+    the respondent metadata joined by id. If columns is given, only those
+    columns of either table are read, in that order.
+    """
+    df_long = read_table(translated_table(code), columns=columns)
+    respondent_columns = None if columns is None else ["id"] + [col for col in columns if col not in df_long.columns]
+    respondents = read_table(respondent_table(code), columns=respondent_columns)
+
+    df = join_respondents(df_long, respondents)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+# %% make data file for HCM
 
 long_columns = [
     'id', 'task', 'package', 'chosen_plan', 'chosen', 'supported',
@@ -343,20 +448,33 @@ values_columns = [
     'climate_worried', 'id', 'country'
 ]
 
-ch_filtered = ch_long[long_columns].copy()
-cn_filtered = cn_long[long_columns].copy()
-values_filtered = values[values_columns].copy()
-
-long_df = pd.concat([ch_filtered, cn_filtered], axis=0)
-combined_df = (
-    long_df
-    .merge(values_filtered, on='id', how='left')
-    .rename(columns={
-        'net_zero_question': 'galtan_3',
-        'climate_worried': 'socio_ecological_3'
-    })
-)
-
-# %% save data file for HCM
-
-combined_df.to_csv("data/hcm_input.csv", index = False)
\ No newline at end of file
+def build_hcm_input(codes):
+    """
+    Input of the choice models: the translated conjoints of the countries
+    with the respondents' metadata and value items, the third item of each
+    scale renamed.
+    """
+    long_df = pd.concat(
+        [read_conjoint(code, columns=long_columns) for code in codes],
+        axis=0
+    )
+    values_filtered = read_table("data_values_ch_cn", columns=values_columns)
+
+    return (
+        long_df
+        .merge(values_filtered, on='id', how='left')
+        .rename(columns={
+            'net_zero_question': 'galtan_3',
+            'climate_worried': 'socio_ecological_3'
+        })
+    )
+
+# %% translate, then save data file for HCM
+
+def main():
+    # one process per country
+    translated_tables = map_countries(translate_country)
+    write_table(build_hcm_input(translated_tables.keys()), "hcm_input")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Wall-clock time and bulk ESS per second of the NUTS backends of
+sampling.sample on the basic or hybrid choice model, fitted to a synthetic
+choice table with the same seed for every backend.
+
+    python tests/benchmark_backends.py
+    python tests/benchmark_backends.py --model hybrid --respondents 200 --backends pymc numpyro
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from scripts.analysis.model_inputs import build_model_inputs
+from scripts.analysis.models import basic_choice_model, hybrid_choice_model
+from scripts.analysis.sampling import SAMPLER_BACKENDS, compare_backends
+from scripts.preprocessing.schema import BASELINES
+from synthetic import TRAIT_ITEMS, synthetic_choice_table
+
+ATTRIBUTES = ["attr_vicinity", "attr_industry", "attr_costs", "attr_source_purpose"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["basic", "hybrid"], default="basic")
+    parser.add_argument("--respondents", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=6)
+    parser.add_argument("--backends", nargs="+", choices=SAMPLER_BACKENDS, default=SAMPLER_BACKENDS)
+    parser.add_argument("--draws", type=int, default=1000)
+    parser.add_argument("--tune", type=int, default=500)
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--cores", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    hybrid = args.model == "hybrid"
+    df = synthetic_choice_table(args.respondents, n_tasks=args.tasks, attributes=ATTRIBUTES)
+    inputs = build_model_inputs(
+        df, ATTRIBUTES, {attr: BASELINES[attr] for attr in ATTRIBUTES}, drop_first=True,
+        traits=TRAIT_ITEMS if hybrid else None, deduplicate=True,
+    )
+    model = (hybrid_choice_model if hybrid else basic_choice_model)(inputs)
+
+    comparison, _ = compare_backends(
+        model,
+        backends=args.backends,
+        var_names=["beta", "delta", "gamma"],
+        draws=args.draws,
+        tune=args.tune,
+        chains=args.chains,
+        cores=args.cores,
+        random_seed=42,
+        progressbar=False,
+    )
+    print(comparison.round(2).to_string())
+
+if __name__ == "__main__":
+    main()
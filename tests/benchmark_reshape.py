@@ -0,0 +1,48 @@
+"""
+Timing of the loop and columnar reshapes of reshape_conjoint_to_long on
+synthetic exports of growing respondent counts.
+
+    python tests/benchmark_reshape.py
+    python tests/benchmark_reshape.py --respondents 100 1000 10000 --skip-loop-above 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from scripts.preprocessing.translate_conjoints import reshape_conjoint_to_long
+from synthetic import synthetic_export
+
+def best_time(func, repeats):
+    """
+    Fastest of repeats calls of func, in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--respondents", nargs="+", type=int, default=[100, 300, 1000, 3000])
+    parser.add_argument("--tasks", type=int, default=12)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-loop-above", type=int, default=1000, help="only time the columnar reshape above this")
+    args = parser.parse_args(argv)
+
+    print(f"{'respondents':>12} {'loop s':>10} {'columnar s':>12} {'speedup':>9}")
+    for n in args.respondents:
+        df = synthetic_export(n, n_tasks=args.tasks)
+        columnar = best_time(lambda: reshape_conjoint_to_long(df, respondent_id_col="id"), args.repeats)
+        if n <= args.skip_loop_above:
+            loop = best_time(lambda: reshape_conjoint_to_long(df, respondent_id_col="id", method="loop"), 1)
+            print(f"{n:>12} {loop:>10.3f} {columnar:>12.3f} {loop / columnar:>8.0f}x")
+        else:
+            print(f"{n:>12} {'':>10} {columnar:>12.3f} {'':>9}")
+
+if __name__ == "__main__":
+    main()
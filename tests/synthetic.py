@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic conjoint export
+#
+# A wide table laid out like an untranslated table after ingest: respondent
+# metadata, then per task the name and package 1 and 2 level columns of
+# each attribute slot, the choice and the support of both packages. The
+# attributes are shuffled over the slots per respondent, and a respondent
+# sees either the source or the purpose attribute (the framing). Some
+# choices and support answers are missing.
+
+ATTRIBUTES = {
+    "vicinity": ["abroad", "another region", "your region", "your municipality"],
+    "reason": ["close to source", "cost-efficient", "sparsely-populated"],
+    "industry": ["waste incineration", "metal and cement production", "gas with CCS"],
+    "costs": ["polluting industry", "taxpayer"],
+    "engagement": ["inform", "consult", "vote"],
+    "source": ["domestic", "foreign"],
+    "purpose": ["domestic", "foreign"],
+}
+
+def synthetic_export(n_respondents, n_tasks=12, missing=0.05, seed=0):
+    """
+    Wide synthetic export with n_respondents rows and n_tasks tasks of six
+    attribute slots.
+    """
+    rng = np.random.default_rng(seed)
+    framed = ["source", "purpose"]
+    common = [attr for attr in ATTRIBUTES if attr not in framed]
+
+    columns = {
+        "id": np.arange(1, n_respondents + 1),
+        "age": rng.integers(18, 80, n_respondents),
+        "gender": rng.choice(["Male", "Female"], n_respondents).astype(object),
+    }
+    framing = rng.choice(framed, n_respondents)
+
+    for task in range(1, n_tasks + 1):
+        names = np.array([rng.permutation(common + [frame]) for frame in framing])
+        for slot in range(1, names.shape[1] + 1):
+            slot_names = names[:, slot - 1]
+            columns[f"c{task}_atr{slot}_name"] = slot_names.astype(object)
+            for package in (1, 2):
+                columns[f"c{task}_atr{slot}_p{package}"] = np.array(
+                    [rng.choice(ATTRIBUTES[name]) for name in slot_names], dtype=object
+                )
+
+        choice = rng.choice(["Plan 1", "Plan 2"], n_respondents).astype(object)
+        choice[rng.random(n_respondents) < missing] = np.nan
+        columns[f"{task}_conjoint_choose12"] = choice
+        for package in (1, 2):
+            support = rng.choice(["In favor", "Against"], n_respondents).astype(object)
+            support[rng.random(n_respondents) < missing] = np.nan
+            columns[f"{task}_conjoint_plan{package}"] = support
+
+    return pd.DataFrame(columns)
+
+TRAIT_ITEMS = {
+    "lreco": ["lreco_1", "lreco_2", "lreco_3"],
+    "galtan": ["galtan_1", "galtan_2", "galtan_3"],
+}
+
+def synthetic_choice_table(n_respondents, n_tasks=6, attributes=None, missing=0.05, seed=0):
+    """
+    Long choice table laid out like hcm_input: one row per respondent, task
+    and package with the attribute levels, framing, country, the choice and
+    Likert answers (0-1) per respondent, some of them missing. attributes
+    defaults to all attributes of the schema.
+    """
+    from scripts.preprocessing.schema import ATTRIBUTE_LEVELS
+
+    rng = np.random.default_rng(seed)
+    attributes = list(ATTRIBUTE_LEVELS) if attributes is None else attributes
+    n_rows = n_respondents * n_tasks * 2
+
+    respondent = np.repeat(np.arange(n_respondents), n_tasks * 2)
+    df = pd.DataFrame({
+        "id": respondent + 1,
+        "task": np.tile(np.repeat(np.arange(1, n_tasks + 1), 2), n_respondents),
+        "package": np.tile([1, 2], n_respondents * n_tasks),
+    })
+    for attr in attributes:
+        df[attr] = rng.choice(ATTRIBUTE_LEVELS[attr], n_rows).astype(object)
+
+    df["framing"] = rng.choice(["purpose", "source"], n_respondents)[respondent]
+    df["country"] = rng.choice(["CH", "CN"], n_respondents)[respondent]
+
+    chose_left = rng.integers(0, 2, n_respondents * n_tasks)
+    df["chosen"] = np.column_stack([chose_left, 1 - chose_left]).ravel()
+
+    for items in TRAIT_ITEMS.values():
+        for item in items:
+            answers = rng.integers(0, 5, n_respondents) / 4
+            answers[rng.random(n_respondents) < missing] = np.nan
+            df[item] = answers[respondent]
+    return df
+
+def synthetic_likelihood_inputs(encoding="index", moderated=False, weighted=False, n_respondents=40, seed=0):
+    """
+    Inputs of the paired logit likelihood Op on a synthetic choice table:
+    random coefficients beta, delta, gamma (and theta and moderators z if
+    moderated), then the design, f, c, the choices and, if weighted, the
+    weights of the deduplicated tasks. Returns the coefficients and the data.
+    """
+    from scripts.analysis.model_inputs import build_model_inputs
+    from scripts.preprocessing.schema import BASELINES
+
+    attributes = ["attr_vicinity", "attr_costs", "attr_source_purpose"]
+    df = synthetic_choice_table(n_respondents, attributes=attributes, seed=seed)
+    inputs = build_model_inputs(
+        df, attributes, {attr: BASELINES[attr] for attr in attributes}, drop_first=True,
+        encoding=encoding, deduplicate=weighted,
+    )
+    coords = inputs["coords"]
+    n_tasks, n_levels = len(inputs["f"]), len(coords["level"])
+
+    rng = np.random.default_rng(seed)
+    coefs = [
+        rng.normal(size=n_levels),
+        rng.normal(size=n_levels),
+        rng.normal(size=(len(coords["country"]), n_levels)),
+    ]
+    if moderated:
+        coefs += [rng.normal(size=(2, n_levels)), rng.normal(size=(n_tasks, 2))]
+
+    if encoding == "index":
+        data = [inputs["level_index_left"], inputs["level_index_right"]]
+    else:
+        data = [inputs["attribute_levels_diff"]]
+    data += [inputs["f"].astype(np.float64), inputs["c"], inputs["observed_choice_left"]]
+    if weighted:
+        data.append(inputs["weight"])
+    return coefs, data
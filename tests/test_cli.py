@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+HEAVY_MODULES = ["pymc", "pytensor", "arviz", "xarray", "pandas"]
+
+# generous, a start that imports pymc takes several seconds
+MAX_STARTUP_SECONDS = 2.0
+
+def imported_modules(args):
+    """
+    Top-level modules imported by python -m scripts with args, read from the
+    -X importtime report, and the wall time of the command.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "scripts", *args],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules, elapsed
+
+@pytest.mark.parametrize("args", [["--help"], ["summarize", "--help"], ["run", "--help"], ["fit-basic", "--help"]])
+def test_help_starts_without_heavy_imports(args):
+    modules, elapsed = imported_modules(args)
+
+    assert "scripts" in modules
+    assert not modules & set(HEAVY_MODULES)
+    assert elapsed < MAX_STARTUP_SECONDS
@@ -0,0 +1,52 @@
+import pandas as pd
+
+from scripts.preprocessing.ingest import read_export
+from scripts.preprocessing.storage import read_table, write_table
+from synthetic import synthetic_export
+
+def write_raw_export(path, n_respondents=30):
+    """
+    Synthetic export as a raw Qualtrics csv: response metadata, two label
+    rows below the header and a postal code column with numbers in the first
+    rows and text later.
+    """
+    df = synthetic_export(n_respondents, n_tasks=2)
+    n = len(df)
+    postal_code = [str(8000 + i) for i in range(n)]
+    postal_code[n // 2:] = [f"CH-{code}" for code in postal_code[n // 2:]]
+    meta = pd.DataFrame({
+        "StartDate": pd.date_range("2025-02-14", periods=n, freq="h").astype(str),
+        "Finished": ["True"] * n,
+        "DistributionChannel": ["anonymous"] * n,
+        "Q_TerminateFlag": [""] * n,
+        "IPAddress": ["127.0.0.1"] * n,
+        "postal_code": postal_code,
+    })
+    raw = pd.concat([meta, df], axis=1)
+
+    labels = pd.DataFrame([raw.columns, raw.columns], columns=raw.columns)
+    pd.concat([labels, raw]).to_csv(path, index=False)
+    return raw
+
+def test_chunked_read_matches_full_read(tmp_path):
+    path = tmp_path / "export.csv"
+    raw = write_raw_export(path)
+
+    chunked = read_export(path, chunksize=10)
+    full = read_export(path, chunksize=len(raw) + 10)
+
+    pd.testing.assert_frame_equal(chunked, full)
+    assert "IPAddress" not in chunked.columns
+    assert chunked["postal_code"].map(type).eq(str).all()
+    assert chunked["age"].dtype == "int64"
+
+def test_chunked_read_writes_parquet(tmp_path):
+    path = tmp_path / "export.csv"
+    write_raw_export(path)
+    df = read_export(path, chunksize=10)
+
+    write_table(df, "export", data_dir=tmp_path)
+    stored = read_table("export", data_dir=tmp_path)
+
+    assert len(stored) == len(df)
+    assert stored["postal_code"].tolist() == df["postal_code"].tolist()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.preprocessing.mapping import _map_column, apply_mapping
+
+MAPPINGS = [{"a": "b", "c": "d"}, {"d": "e"}]
+
+@pytest.mark.parametrize("as_categorical", [False, True])
+def test_map_column_all_missing(as_categorical):
+    series = pd.Series([np.nan, np.nan], name="col")
+    mapped = _map_column(series, [{"a": "b"}], as_categorical=as_categorical)
+
+    assert mapped.isna().all()
+    assert len(mapped) == 2
+
+@pytest.mark.parametrize("as_categorical", [False, True])
+def test_map_column_mixed(as_categorical):
+    series = pd.Series(["a", np.nan, "c", "x", np.nan, "a"], name="col")
+    mapped = _map_column(series, MAPPINGS, as_categorical=as_categorical)
+
+    assert mapped.isna().tolist() == [False, True, False, False, True, False]
+    assert mapped.dropna().astype(object).tolist() == ["b", "e", "x", "b"]
+
+def test_map_column_categorical_input():
+    series = pd.Series(pd.Categorical(["c", np.nan, "a"], categories=["a", "c", "z"]))
+    mapped = _map_column(series, MAPPINGS, as_categorical=True)
+
+    assert mapped.astype(object).tolist()[::2] == ["e", "b"]
+    assert pd.isna(mapped[1])
+
+def test_apply_mapping_columns():
+    df = pd.DataFrame({"x1": ["a", "c"], "x2": ["a", np.nan], "y": ["a", "a"]})
+    apply_mapping(df, MAPPINGS, columns=["x1", "x2"])
+
+    assert df["x1"].tolist() == ["b", "e"]
+    assert df["x2"][0] == "b" and pd.isna(df["x2"][1])
+    assert df["y"].tolist() == ["a", "a"]
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.analysis.marginal_means import amce, marginal_means
+from synthetic import synthetic_choice_table
+
+FEATURES = ["attr_vicinity", "attr_costs"]
+
+CREGG_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "cregg")
+
+def choice_data(n_respondents=60, seed=1):
+    df = synthetic_choice_table(n_respondents, n_tasks=4, attributes=FEATURES, seed=seed)
+    df["chosen"] = df["chosen"].astype(float)
+    df.loc[df.index[::37], "chosen"] = np.nan
+    return df
+
+def naive_marginal_means(df, feature, by=None):
+    """
+    Marginal means and CR1 standard errors, one respondent at a time.
+    """
+    df = df[df["chosen"].notna()]
+    rows = []
+    for key, sub in (df.groupby(by, sort=True) if by else [(None, df)]):
+        ids = sub["id"].unique()
+        for level in sorted(sub[feature].unique()):
+            y = sub.loc[sub[feature] == level, "chosen"]
+            estimate = y.mean()
+            squares = 0.0
+            for id in ids:
+                mine = sub[(sub["id"] == id) & (sub[feature] == level)]
+                squares += (mine["chosen"] - estimate).sum() ** 2
+            std_error = np.sqrt(len(ids) / (len(ids) - 1) * squares) / len(y)
+            rows.append({by or "all": key, "level": level, "estimate": estimate, "std_error": std_error, "n": len(y)})
+    return pd.DataFrame(rows)
+
+def naive_amce(df, features):
+    """
+    AMCEs and CR1 standard errors from np.linalg.lstsq and the cluster
+    sandwich summed one respondent at a time; the first level is the baseline.
+    """
+    df = df[df["chosen"].notna()]
+    levels = {feature: sorted(df[feature].unique()) for feature in features}
+    X = np.column_stack(
+        [np.ones(len(df))]
+        + [(df[feature] == level).to_numpy(dtype=float) for feature in features for level in levels[feature][1:]]
+    )
+    y = df["chosen"].to_numpy()
+    coefs = np.linalg.lstsq(X, y, rcond=None)[0]
+    residual = y - X @ coefs
+
+    ids = df["id"].to_numpy()
+    meat = np.zeros((X.shape[1], X.shape[1]))
+    for id in np.unique(ids):
+        score = X[ids == id].T @ residual[ids == id]
+        meat += np.outer(score, score)
+    bread = np.linalg.inv(X.T @ X)
+    n_clusters = len(np.unique(ids))
+    vcov = n_clusters / (n_clusters - 1) * bread @ meat @ bread
+
+    names = [(feature, level) for feature in features for level in levels[feature][1:]]
+    return pd.DataFrame({
+        "feature": [name[0] for name in names],
+        "level": [name[1] for name in names],
+        "estimate": coefs[1:],
+        "std_error": np.sqrt(np.diag(vcov))[1:],
+    })
+
+def test_marginal_means_cr1_fixture():
+    # three respondents; level x: 1 | 1, 0 | 0, level y: 0 | - | 1
+    df = pd.DataFrame({
+        "id": [1, 1, 2, 2, 3, 3],
+        "attr": ["x", "y", "x", "x", "y", "x"],
+        "chosen": [1, 0, 1, 0, 1, 0],
+    })
+    result = marginal_means(df, ["attr"]).set_index("level")
+
+    # cluster residual sums 0.5, 0, -0.5 (x) and -0.5, 0, 0.5 (y), G = 3
+    np.testing.assert_allclose(result["estimate"], [0.5, 0.5])
+    np.testing.assert_allclose(result.loc["x", "std_error"], np.sqrt(3 / 2 * 0.5) / 4)
+    np.testing.assert_allclose(result.loc["y", "std_error"], np.sqrt(3 / 2 * 0.5) / 2)
+    assert result["n"].tolist() == [4, 2]
+
+@pytest.mark.parametrize("by", [None, "country"])
+def test_marginal_means_match_naive(by):
+    df = choice_data()
+    result = marginal_means(df, FEATURES, by=[by] if by else None)
+
+    for feature in FEATURES:
+        expected = naive_marginal_means(df, feature, by)
+        got = result[result["feature"] == feature]
+        np.testing.assert_allclose(got["estimate"], expected["estimate"], rtol=1e-12)
+        np.testing.assert_allclose(got["std_error"], expected["std_error"], rtol=1e-12)
+        assert got["n"].tolist() == expected["n"].tolist()
+        if by:
+            assert got[by].tolist() == expected[by].tolist()
+
+def test_amce_matches_lstsq_sandwich():
+    df = choice_data()
+    result = amce(df, FEATURES)
+    expected = naive_amce(df, FEATURES)
+
+    got = result.merge(expected, on=["feature", "level"], suffixes=("", "_expected"))
+    assert len(got) == len(expected)
+    np.testing.assert_allclose(got["estimate"], got["estimate_expected"], rtol=1e-10)
+    np.testing.assert_allclose(got["std_error"], got["std_error_expected"], rtol=1e-10)
+
+    # baselines are reported with estimate 0
+    baselines = result[~result.set_index(["feature", "level"]).index.isin(got.set_index(["feature", "level"]).index)]
+    assert (baselines["estimate"] == 0).all() and baselines["std_error"].isna().all()
+
+def test_amce_by_subgroup_matches_separate_fits():
+    df = choice_data()
+    result = amce(df, FEATURES, by=["country"])
+
+    for country, sub in df.groupby("country"):
+        expected = naive_amce(sub, FEATURES)
+        got = result[result["country"] == country].merge(expected, on=["feature", "level"], suffixes=("", "_expected"))
+        np.testing.assert_allclose(got["estimate"], got["estimate_expected"], rtol=1e-10)
+        np.testing.assert_allclose(got["std_error"], got["std_error_expected"], rtol=1e-10)
+
+def _cregg_output(name):
+    path = os.path.join(CREGG_DIR, name)
+    if not os.path.exists(path):
+        pytest.skip(f"{name} not generated, run Rscript tests/fixtures/cregg/reference.R")
+    return pd.read_csv(path)
+
+@pytest.mark.parametrize("estimate, by", [("mm", None), ("mm", "country"), ("amce", None)])
+def test_matches_cregg(estimate, by):
+    name = f"{estimate}_by_{by}.csv" if by else f"{estimate}.csv"
+    expected = _cregg_output(name)
+    df = pd.read_csv(os.path.join(CREGG_DIR, "conjoint.csv"))
+
+    if estimate == "mm":
+        result = marginal_means(df, FEATURES, by=[by] if by else None)
+    else:
+        result = amce(df, FEATURES)
+
+    keys = ["feature", "level"] + ([by] if by else [])
+    got = result.merge(expected, on=keys, suffixes=("", "_cregg"))
+    assert len(got) == len(expected)
+    np.testing.assert_allclose(got["estimate"], got["estimate_cregg"], rtol=1e-8, atol=1e-12)
+    identified = got["std_error_cregg"].notna()
+    np.testing.assert_allclose(got["std_error"][identified], got["std_error_cregg"][identified], rtol=1e-6)
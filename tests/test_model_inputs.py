@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from scripts.analysis.design import utility_difference
+from scripts.analysis.model_inputs import build_model_inputs, deduplicate_tasks
+from scripts.preprocessing.schema import BASELINES
+from synthetic import TRAIT_ITEMS, synthetic_choice_table
+
+# few levels, so many tasks repeat within and across respondents
+ATTRIBUTES = ["attr_costs", "attr_source_purpose"]
+
+def model_inputs(encoding="index", traits=None, deduplicate=False):
+    df = synthetic_choice_table(50, n_tasks=8, attributes=ATTRIBUTES)
+    return build_model_inputs(
+        df, ATTRIBUTES, {attr: BASELINES[attr] for attr in ATTRIBUTES}, drop_first=True,
+        encoding=encoding, traits=traits, deduplicate=deduplicate,
+    )
+
+def loglike(inputs, encoding, coefs, latent=None):
+    """
+    Summed (weighted) log-likelihood of the choices, moderated by the
+    latent traits of each task's respondent if given.
+    """
+    if encoding == "index":
+        design = [inputs["level_index_left"], inputs["level_index_right"]]
+    else:
+        design = [inputs["attribute_levels_diff"]]
+    theta, z = (coefs[3], latent[inputs["individual_idx"]]) if latent is not None else (None, None)
+    eta = utility_difference(*coefs[:3], design, inputs["f"], inputs["c"], encoding, theta=theta, z=z)
+    y = inputs["observed_choice_left"]
+    weight = inputs.get("weight", np.ones(len(y)))
+    return (weight * -np.logaddexp(0, np.where(y == 1, -eta, eta))).sum()
+
+@pytest.mark.parametrize("encoding", ["index", "dummies"])
+@pytest.mark.parametrize("traits", [None, TRAIT_ITEMS])
+def test_deduplicated_loglike_matches_expanded(encoding, traits):
+    expanded = model_inputs(encoding, traits)
+    deduplicated = model_inputs(encoding, traits, deduplicate=True)
+    assert len(deduplicated["f"]) < len(expanded["f"])
+
+    rng = np.random.default_rng(0)
+    n_levels, n_countries = len(expanded["coords"]["level"]), len(expanded["coords"]["country"])
+    coefs = [rng.normal(size=n_levels), rng.normal(size=n_levels), rng.normal(size=(n_countries, n_levels))]
+    latent = None
+    if traits:
+        coefs.append(rng.normal(size=(len(traits), n_levels)))
+        latent = rng.normal(size=(len(expanded["coords"]["individual"]), len(traits)))
+
+    np.testing.assert_allclose(
+        loglike(deduplicated, encoding, coefs, latent), loglike(expanded, encoding, coefs, latent), rtol=1e-12
+    )
+
+def test_deduplicate_keeps_respondents_apart():
+    inputs = model_inputs()
+    n_individuals = len(inputs["coords"]["individual"])
+    tasks_per_individual = np.bincount(inputs["individual_idx"], minlength=n_individuals)
+
+    # each respondent's weights add up to their own tasks
+    within = deduplicate_tasks(inputs, by_individual=True)
+    np.testing.assert_array_equal(
+        np.bincount(within["individual_idx"], within["weight"], minlength=n_individuals), tasks_per_individual
+    )
+
+    # respondents share tasks, which only collapse across respondents without traits
+    across = deduplicate_tasks(inputs, by_individual=False)
+    assert "individual_idx" not in across
+    assert len(across["f"]) < len(within["f"])
+    assert across["weight"].sum() == within["weight"].sum() == len(inputs["f"])
+
+def test_traits_collapse_within_respondents():
+    inputs = model_inputs(traits=TRAIT_ITEMS, deduplicate=True)
+    expanded = model_inputs(traits=TRAIT_ITEMS)
+    n_individuals = len(expanded["coords"]["individual"])
+
+    np.testing.assert_array_equal(
+        np.bincount(inputs["individual_idx"], inputs["weight"], minlength=n_individuals),
+        np.bincount(expanded["individual_idx"], minlength=n_individuals),
+    )
@@ -0,0 +1,35 @@
+from scripts import pipeline
+
+def toy_stages(tmp_path):
+    """
+    Stage a writes a.txt, stage b reads it and writes b.txt.
+    """
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.py").write_text("")
+    return {
+        "a": {"script": "a.py", "code": [], "deps": [], "inputs": [], "outputs": ["a.txt"]},
+        "b": {"script": "b.py", "code": [], "deps": ["a"], "inputs": ["a.txt"], "outputs": ["b.txt"]},
+    }
+
+def test_dry_run_reports_stages_with_missing_inputs(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pipeline, "STAGES", toy_stages(tmp_path))
+    monkeypatch.setattr(pipeline, "STATE_FILE", str(tmp_path / "state" / "state.json"))
+
+    # b never ran and its input is missing, but an old output exists
+    (tmp_path / "b.txt").write_text("old")
+    pipeline.run(["b"], dry_run=True)
+
+    assert capsys.readouterr().out.splitlines() == ["a: would run a.py", "b: would run b.py"]
+
+def test_dry_run_reports_up_to_date_stages(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pipeline, "STAGES", toy_stages(tmp_path))
+    monkeypatch.setattr(pipeline, "STATE_FILE", str(tmp_path / "state" / "state.json"))
+    monkeypatch.setattr(pipeline, "run_stage", lambda name: (tmp_path / f"{name}.txt").write_text(name))
+
+    pipeline.run(["b"])
+    capsys.readouterr()
+    pipeline.run(["b"], dry_run=True)
+
+    assert capsys.readouterr().out.splitlines() == ["a: up to date", "b: up to date"]
@@ -0,0 +1,23 @@
+import pandas as pd
+import pytest
+
+from scripts.preprocessing.translate_conjoints import reshape_conjoint_to_long
+from synthetic import synthetic_export
+
+@pytest.mark.parametrize("n_respondents, n_tasks", [(30, 3), (60, 12)])
+def test_columnar_reshape_matches_loop(n_respondents, n_tasks):
+    df = synthetic_export(n_respondents, n_tasks=n_tasks)
+
+    columnar = reshape_conjoint_to_long(df, respondent_id_col="id", method="columnar")
+    loop = reshape_conjoint_to_long(df, respondent_id_col="id", method="loop")
+
+    pd.testing.assert_frame_equal(columnar, loop)
+
+def test_columnar_reshape_merges_framing():
+    df = synthetic_export(20, n_tasks=2)
+    long_df = reshape_conjoint_to_long(df, respondent_id_col="id")
+
+    assert len(long_df) == 20 * 2 * 2
+    assert "attr_source" not in long_df.columns and "attr_purpose" not in long_df.columns
+    assert long_df["attr_source_purpose"].notna().all()
+    assert set(long_df["framing"]) == {"source", "purpose"}